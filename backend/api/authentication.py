@@ -0,0 +1,38 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram.db_router import use_replicas
+
+
+def get_token_cache_key(key):
+    # В ключ кэша попадает хэш, а не сам токен
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_tokens(keys):
+    cache.delete_many([get_token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''TokenAuthentication, хранящий найденный токен с пользователем в кэше.
+
+    Запрос к базе данных выполняется только при первом обращении с токеном
+    и после истечения TOKEN_CACHE_TIMEOUT. Записи удаляются при выходе,
+    удалении токена и любом сохранении пользователя (смена пароля,
+    блокировка), см. api.signals.
+    '''
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            # Неверные токены и неактивные пользователи не кэшируются:
+            # родительский метод вызывает AuthenticationFailed. Только
+            # что выданного токена на реплике может еще не быть
+            with use_replicas(False):
+                user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, token, settings.TOKEN_CACHE_TIMEOUT)
+        return token.user, token
@@ -0,0 +1,48 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from recipes.versions import get_table_version
+
+
+def reference_data_cache(model):
+    '''Условный GET для справочных данных модели.
+
+    ETag строится из версии таблицы и адреса запроса, Last-Modified —
+    из времени последней записи. Оба берутся из кэша, поэтому ответ 304
+    отдается без обращения к базе данных и сериализатору.
+    '''
+
+    def etag_func(request, *args, **kwargs):
+        version, _ = get_table_version(model)
+        variant = hashlib.md5(
+            f'{request.get_full_path()}|{request.META.get("HTTP_ACCEPT")}'
+            .encode()
+        ).hexdigest()
+        return f'{version}-{variant}'
+
+    def last_modified_func(request, *args, **kwargs):
+        _, modified = get_table_version(model)
+        return modified
+
+    def decorator(view_func):
+        conditional_view = condition(
+            etag_func=etag_func,
+            last_modified_func=last_modified_func,
+        )(view_func)
+
+        @wraps(view_func)
+        def inner(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                patch_cache_control(
+                    response,
+                    public=True,
+                    max_age=settings.REFERENCE_CACHE_MAX_AGE,
+                )
+            return response
+        return inner
+    return decorator
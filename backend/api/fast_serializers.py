@@ -0,0 +1,144 @@
+# Быстрая сериализация списков без полей DRF.
+# Функции строят словари прямо из строк .values() и должны давать тот же
+# результат, что и сериализаторы api.serializers, вплоть до порядка ключей.
+# Совпадение проверяет команда benchmark_serialization; при изменении полей
+# сериализаторов этот модуль нужно менять вместе с ними.
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+
+from recipes.images import IMAGE_FORMATS, IMAGE_SIZES
+from recipes.models import AmountIngredient, Recipe
+from .viewer import get_viewer_context
+
+User = get_user_model()
+
+USER_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+USER_COUNTER_FIELDS = ('recipes_count', 'followers_count')
+# Столбцы рецепта, которые читает serialize_recipes
+RECIPE_FIELDS = (
+    'id', 'name', 'image', 'image_variants', 'text', 'cooking_time',
+    'author_id', 'favorites_count', 'shopping_cart_count',
+)
+
+
+def get_absolute_url(request, name):
+    url = default_storage.url(name)
+    if request is not None:
+        url = request.build_absolute_uri(url)
+    return url
+
+
+def get_images(request, image, variants):
+    # Повторяет GetRecipeSerializer.get_images
+    if not image:
+        return None
+    original = get_absolute_url(request, image)
+    images = {}
+    for size in IMAGE_SIZES:
+        size_variants = variants.get(size, {})
+        images[size] = {
+            extension: (get_absolute_url(request, size_variants[extension])
+                        if extension in size_variants else original)
+            for extension in IMAGE_FORMATS
+        }
+    return images
+
+
+def get_authors(author_ids, following_ids):
+    authors = {}
+    for author in User.objects.filter(id__in=author_ids).values(
+        *USER_FIELDS, *USER_COUNTER_FIELDS
+    ):
+        # Порядок ключей как в UserSerializer: флаг подписки до счетчиков
+        counters = {
+            field: author.pop(field) for field in USER_COUNTER_FIELDS
+        }
+        author['is_subscribed'] = author['id'] in following_ids
+        author.update(counters)
+        authors[author['id']] = author
+    return authors
+
+
+def get_tags(recipe_ids):
+    # Порядок тегов совпадает с сортировкой модели Tag, как в prefetch
+    tags = defaultdict(list)
+    rows = Recipe.tags.through.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('tag__name').values_list(
+        'recipe_id', 'tag__id', 'tag__name', 'tag__color', 'tag__slug'
+    )
+    for recipe_id, pk, name, color, slug in rows:
+        tags[recipe_id].append(
+            {'id': pk, 'name': name, 'color': color, 'slug': slug}
+        )
+    return tags
+
+
+def get_ingredients(recipe_ids):
+    ingredients = defaultdict(list)
+    rows = AmountIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('id').values_list(
+        'recipe_id', 'ingredient__id', 'ingredient__name',
+        'ingredient__measurement_unit', 'amount'
+    )
+    for recipe_id, pk, name, unit, amount in rows:
+        ingredients[recipe_id].append({
+            'id': pk,
+            'name': name,
+            'measurement_unit': unit,
+            'amount': amount,
+        })
+    return ingredients
+
+
+def serialize_recipes(rows, request):
+    '''Аналог GetRecipeSerializer(many=True) для строк
+    Recipe.values(*RECIPE_FIELDS).
+
+    Автор, теги и ингредиенты страницы загружаются тремя запросами.
+    '''
+    rows = list(rows)
+    if not rows:
+        return []
+    viewer = get_viewer_context(request)
+    if viewer is None:
+        favorite_ids = shopping_cart_ids = following_ids = frozenset()
+    else:
+        favorite_ids = viewer.favorite_ids
+        shopping_cart_ids = viewer.shopping_cart_ids
+        following_ids = viewer.following_ids
+    recipe_ids = [row['id'] for row in rows]
+    authors = get_authors(
+        {row['author_id'] for row in rows}, following_ids
+    )
+    tags = get_tags(recipe_ids)
+    ingredients = get_ingredients(recipe_ids)
+    return [
+        {
+            'id': row['id'],
+            'tags': tags[row['id']],
+            'author': authors[row['author_id']],
+            'ingredients': ingredients[row['id']],
+            'is_favorited': row['id'] in favorite_ids,
+            'is_in_shopping_cart': row['id'] in shopping_cart_ids,
+            'name': row['name'],
+            'image': (get_absolute_url(request, row['image'])
+                      if row['image'] else None),
+            'images': get_images(
+                request, row['image'], row['image_variants']
+            ),
+            'text': row['text'],
+            'cooking_time': row['cooking_time'],
+            'favorites_count': row['favorites_count'],
+            'shopping_cart_count': row['shopping_cart_count'],
+        }
+        for row in rows
+    ]
+
+
+def serialize_values(queryset, serializer_class):
+    '''Аналог простого ModelSerializer(many=True) без вложенных полей.'''
+    return list(queryset.values(*serializer_class.Meta.fields))
@@ -0,0 +1,25 @@
+import hashlib
+
+from django.core.files.storage import default_storage
+from drf_extra_fields.fields import Base64ImageField
+
+
+class HashedBase64ImageField(Base64ImageField):
+    '''Изображение в base64, сохраняемое под хэшем содержимого.
+
+    Если файл с таким содержимым уже загружен, возвращается его имя
+    и повторно ничего не записывается.
+    '''
+
+    def get_file_name(self, decoded_file):
+        return hashlib.sha256(decoded_file).hexdigest()
+
+    def to_internal_value(self, base64_data):
+        file = super().to_internal_value(base64_data)
+        if file is None:
+            return file
+        model_field = self.parent.Meta.model._meta.get_field(self.source)
+        name = model_field.generate_filename(None, file.name)
+        if default_storage.exists(name):
+            return name
+        return file
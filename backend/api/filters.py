@@ -1,6 +1,9 @@
 from django_filters import rest_framework
+from rest_framework.filters import OrderingFilter
 
-from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_recipes
+from .viewer import get_viewer_context
 
 
 class FilterForRecipes(rest_framework.FilterSet):
@@ -17,31 +20,63 @@ class FilterForRecipes(rest_framework.FilterSet):
     tags = rest_framework.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='tags_method',
     )
+    # any — рецепт с любым из тегов, all — со всеми тегами сразу
+    tags_match = rest_framework.ChoiceFilter(
+        choices=(('any', 'any'), ('all', 'all')),
+        method='tags_match_method',
+    )
+    # Полнотекстовый поиск, результаты сортируются по релевантности
+    search = rest_framework.CharFilter(method='search_method')
+
+    # Рецепт должен попадать в выдачу один раз без DISTINCT, иначе
+    # дубликаты искажают страницы и COUNT пагинатора. Для any теги
+    # проверяются полусоединением id IN (SELECT recipe_id ...), для all —
+    # отдельным JOIN на каждый тег: пара (рецепт, тег) уникальна, поэтому
+    # каждый JOIN дает не больше одной строки
+    def tags_method(self, queryset, name, value):
+        if not value:
+            return queryset
+        if self.form.cleaned_data.get('tags_match') == 'all':
+            for tag in value:
+                queryset = queryset.filter(tags=tag.id)
+            return queryset
+        return queryset.filter(id__in=Recipe.tags.through.objects.filter(
+            tag_id__in=[tag.id for tag in value]
+        ).values('recipe_id'))
+
+    def tags_match_method(self, queryset, name, value):
+        # Учитывается в tags_method
+        return queryset
+
+    def search_method(self, queryset, name, value):
+        return search_recipes(queryset, value)
 
     def is_favorited_method(self, queryset, name, value):
-        if self.request.user.is_anonymous:
+        viewer = get_viewer_context(self.request)
+        if viewer is None:
             return Recipe.objects.none()
 
-        favorites = (Favorite.objects.filter(user=self.request.user).
-                     values_list('recipe_id', flat=True))
+        favorites = viewer.favorite_ids
         if value:
             return queryset.filter(id__in=favorites)
         return queryset.exclude(id__in=favorites)
 
     def is_in_shopping_cart_method(self, queryset, name, value):
-        if self.request.user.is_anonymous:
+        viewer = get_viewer_context(self.request)
+        if viewer is None:
             return Recipe.objects.none()
-        shopping_cart = (ShoppingCart.objects.filter(user=self.request.user).
-                         values_list('recipe_id', flat=True))
+        shopping_cart = viewer.shopping_cart_ids
         if value:
             return queryset.filter(id__in=shopping_cart)
         return queryset.exclude(id__in=shopping_cart)
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'tags_match', 'is_favorited',
+                  'is_in_shopping_cart', 'search')
 
 
 class FilterForIngredients(rest_framework.FilterSet):
@@ -50,3 +85,39 @@ class FilterForIngredients(rest_framework.FilterSet):
     class Meta:
         model = Ingredient
         fields = ('name',)
+
+
+class StableOrderingFilter(OrderingFilter):
+    '''Сортировка по параметру ordering с первичным ключом в конце.
+
+    Без него строки с равными значениями (например, счетчиками) могут
+    переходить между страницами. Атрибут представления ordering_aliases
+    задает короткие имена сортировок: {'trending': '-trending_score'},
+    минус перед именем обращает направление.
+    '''
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        aliases = getattr(view, 'ordering_aliases', {})
+        resolved = []
+        for term in fields:
+            name = term.lstrip('-')
+            if name in aliases:
+                alias = aliases[name]
+                if term.startswith('-'):
+                    alias = (alias[1:] if alias.startswith('-')
+                             else f'-{alias}')
+                term = alias
+            resolved.append(term)
+        return super().remove_invalid_fields(
+            queryset, resolved, view, request
+        )
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        pk_name = queryset.model._meta.pk.name
+        if any(field.lstrip('-') in ('pk', pk_name) for field in ordering):
+            return ordering
+        descending = ordering[0].startswith('-')
+        return [*ordering, f'-{pk_name}' if descending else pk_name]
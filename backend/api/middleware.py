@@ -0,0 +1,282 @@
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from foodgram.db_router import use_replicas
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimings:
+    '''Время выполнения частей одного запроса, в секундах.'''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view_name = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_start = None
+        self.serializer_time = 0.0
+        self.render_start = None
+        self.render_time = 0.0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            if duration * 1000 >= settings.SLOW_QUERY_MS:
+                logger.warning(
+                    'Медленный запрос %.1f мс в %s: %s',
+                    duration * 1000, self.view_name, sql
+                )
+
+    # Сериализация считается от первого get_serializer до finalize_response
+    # за вычетом времени запросов к базе данных в этом промежутке
+    def start_serializer(self):
+        if self.serializer_start is None:
+            self.serializer_start = (time.perf_counter(), self.db_time)
+
+    def stop_serializer(self):
+        if self.serializer_start is None:
+            return
+        start, db_time = self.serializer_start
+        self.serializer_time = max(
+            time.perf_counter() - start - (self.db_time - db_time), 0.0
+        )
+
+    def stop_render(self, response):
+        if self.render_start is not None:
+            self.render_time = time.perf_counter() - self.render_start
+
+    def get_metrics(self):
+        return {
+            'total': time.perf_counter() - self.start,
+            'db': self.db_time,
+            'queries': self.queries,
+            'serialize': self.serializer_time,
+            'render': self.render_time,
+        }
+
+
+def get_view_name(view_func, method):
+    # Для ViewSet имя включает действие (RecipeViewSet.list), для
+    # остальных представлений на классах — метод HTTP
+    view_class = getattr(view_func, 'cls', None) or getattr(
+        view_func, 'view_class', None
+    )
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    method = method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+class EndpointMetrics:
+    '''Скользящая статистика по последним запросам каждого представления.
+
+    Каждый воркер gunicorn копит выборки в памяти и не чаще раза в
+    METRICS_PUBLISH_INTERVAL секунд публикует их в общий кэш. Снимок
+    объединяет выборки всех воркеров, публиковавшихся за последние
+    METRICS_TIMEOUT секунд, поэтому не зависит от того, какой воркер
+    принял запрос. Последние выборки воркера попадают в кэш с его
+    следующей публикацией.
+    '''
+
+    workers_key = 'endpoint-metrics:workers'
+
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._published = None
+
+    @staticmethod
+    def get_worker():
+        # Вычисляется при каждой публикации: воркеры gunicorn могут
+        # получить объект от родительского процесса
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def add(self, view_name, status_code, metrics):
+        now = time.monotonic()
+        with self._lock:
+            self._samples[view_name].append((status_code, metrics))
+            due = (self._published is None or now - self._published
+                   >= settings.METRICS_PUBLISH_INTERVAL)
+            if due:
+                self._published = now
+        if due:
+            self.publish()
+
+    def publish(self):
+        with self._lock:
+            samples = {
+                name: list(items) for name, items in self._samples.items()
+            }
+        worker = self.get_worker()
+        cache.set(
+            f'endpoint-metrics:{worker}', samples, settings.METRICS_TIMEOUT
+        )
+        # Список воркеров обновляется без блокировки: потерянная при
+        # одновременной записи отметка восстановится при следующей
+        # публикации
+        now = time.time()
+        workers = {
+            name: published
+            for name, published in (cache.get(self.workers_key) or {}).items()
+            if now - published < settings.METRICS_TIMEOUT
+        }
+        workers[worker] = now
+        cache.set(self.workers_key, workers, settings.METRICS_TIMEOUT)
+
+    def get_samples(self):
+        self.publish()
+        workers = cache.get(self.workers_key) or {}
+        published = cache.get_many(
+            [f'endpoint-metrics:{worker}' for worker in workers]
+        )
+        samples = defaultdict(list)
+        for worker_samples in published.values():
+            for name, items in worker_samples.items():
+                samples[name].extend(items)
+        return samples
+
+    @staticmethod
+    def percentile(values, percent):
+        index = max(round(percent / 100 * len(values)) - 1, 0)
+        return values[index]
+
+    def get_snapshot(self):
+        samples = self.get_samples()
+        snapshot = {}
+        for name, items in sorted(samples.items()):
+            totals = sorted(metrics['total'] * 1000 for _, metrics in items)
+            means = {
+                key: sum(metrics[key] for _, metrics in items) / len(items)
+                for key in ('queries', 'db', 'serialize', 'render')
+            }
+            snapshot[name] = {
+                'requests': len(items),
+                'errors': sum(1 for status, _ in items if status >= 500),
+                'p50_ms': round(self.percentile(totals, 50), 3),
+                'p95_ms': round(self.percentile(totals, 95), 3),
+                'p99_ms': round(self.percentile(totals, 99), 3),
+                'mean_queries': round(means['queries'], 2),
+                'max_queries': max(
+                    metrics['queries'] for _, metrics in items),
+                'mean_db_ms': round(means['db'] * 1000, 3),
+                'mean_serialize_ms': round(means['serialize'] * 1000, 3),
+                'mean_render_ms': round(means['render'] * 1000, 3),
+            }
+        return snapshot
+
+
+endpoint_metrics = EndpointMetrics(settings.METRICS_WINDOW)
+
+
+class ServerTimingMiddleware:
+    '''Число и время SQL-запросов, время сериализации и отрисовки ответа.
+
+    Результат отдается заголовком Server-Timing и накапливается
+    в endpoint_metrics. Запросы дольше SLOW_QUERY_MS пишутся в лог
+    вместе с именем представления.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = request.server_timing = RequestTimings()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(timings.execute_wrapper)
+                )
+            response = self.get_response(request)
+        metrics = timings.get_metrics()
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={metrics["db"] * 1000:.1f};'
+            f'desc="{metrics["queries"]} queries"',
+            f'serialize;dur={metrics["serialize"] * 1000:.1f}',
+            f'render;dur={metrics["render"] * 1000:.1f}',
+            f'total;dur={metrics["total"] * 1000:.1f}',
+        ))
+        if timings.view_name is not None:
+            endpoint_metrics.add(
+                timings.view_name, response.status_code, metrics
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.server_timing.view_name = get_view_name(
+            view_func, request.method
+        )
+
+    def process_template_response(self, request, response):
+        # Вызывается непосредственно перед отрисовкой Response DRF
+        timings = request.server_timing
+        timings.render_start = time.perf_counter()
+        response.add_post_render_callback(timings.stop_render)
+        return response
+
+
+# Отметка недавней записи: cookie для браузера, ключ кэша для клиентов
+# с токеном
+PRIMARY_PIN_COOKIE = 'pin_primary'
+
+
+def get_primary_pin_key(request):
+    authorization = request.headers.get('Authorization')
+    if not authorization:
+        return None
+    return ('primary-pin:'
+            + hashlib.sha256(authorization.encode()).hexdigest())
+
+
+class ReplicaRoutingMiddleware:
+    '''Безопасные запросы API читают данные с реплик DATABASE_REPLICAS.
+
+    После запроса, меняющего данные, клиент на REPLICA_PIN_SECONDS
+    закрепляется за основной базой, чтобы видеть свои изменения
+    несмотря на отставание реплик.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (not settings.DATABASE_REPLICAS
+                or not request.path.startswith('/api/')):
+            return self.get_response(request)
+        pin_key = get_primary_pin_key(request)
+        if request.method in SAFE_METHODS:
+            pinned = PRIMARY_PIN_COOKIE in request.COOKIES or (
+                pin_key is not None and cache.get(pin_key)
+            )
+            # Потоковые ответы дочитываются после выхода из блока
+            # уже из основной базы
+            with use_replicas(not pinned):
+                return self.get_response(request)
+        response = self.get_response(request)
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE, '1',
+            max_age=settings.REPLICA_PIN_SECONDS,
+            httponly=True,
+            samesite='Lax',
+        )
+        if pin_key is not None:
+            cache.set(pin_key, True, settings.REPLICA_PIN_SECONDS)
+        return response
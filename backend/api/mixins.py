@@ -1,7 +1,27 @@
 from rest_framework import mixins, viewsets
 
 
+class ServerTimingMixin:
+    '''Отмечает время сериализации для заголовка Server-Timing.'''
+
+    def start_serializer_timing(self):
+        timings = getattr(self.request, 'server_timing', None)
+        if timings is not None:
+            timings.start_serializer()
+
+    def get_serializer(self, *args, **kwargs):
+        self.start_serializer_timing()
+        return super().get_serializer(*args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        timings = getattr(request, 'server_timing', None)
+        if timings is not None:
+            timings.stop_serializer()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
 class ListRetrieveMixin(
+    ServerTimingMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     viewsets.GenericViewSet
@@ -1,7 +1,183 @@
+import base64
+import json
+from decimal import Decimal
+
 from django.conf import settings
-from rest_framework.pagination import PageNumberPagination
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       remove_query_param,
+                                       replace_query_param)
+from rest_framework.response import Response
+
+
+class KeysetPagination(BasePagination):
+    '''Пагинация по ключу (keyset) вместо OFFSET.
+
+    Курсор хранит значения полей сортировки последнего объекта страницы,
+    следующая страница выбирается условием "строго после курсора", поэтому
+    стоимость запроса не растет с номером страницы и не требует COUNT(*).
+    Для стабильного порядка к сортировке всегда добавляется первичный ключ.
+    Поддерживается только движение вперед, как при бесконечной прокрутке.
+    '''
+
+    page_size = settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        # Пары (имя для фильтра и значения объекта, поле для разбора)
+        self.fields = [
+            self.get_field(queryset, field.lstrip('-'))
+            for field in self.ordering
+        ]
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        # Запрашиваем на один объект больше, чтобы узнать о следующей странице
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = list(
+            queryset.query.order_by or queryset.model._meta.ordering
+        )
+        if not all(isinstance(field, str) for field in ordering):
+            raise NotFound('Сортировка выражением не поддерживает курсор')
+        pk_name = queryset.model._meta.pk.name
+        if not any(field.lstrip('-') in ('pk', pk_name)
+                   for field in ordering):
+            # Направление первичного ключа совпадает с первым полем
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering.append(f'-{pk_name}' if descending else pk_name)
+        return ordering
+
+    @staticmethod
+    def get_field(queryset, name):
+        # Сортировать можно по полям модели и по аннотациям запроса
+        model = queryset.model
+        if name == 'pk':
+            return model._meta.pk.attname, model._meta.pk
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return name, annotation.output_field
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise NotFound(
+                f'Сортировка по полю {name} не поддерживает курсор')
+        return field.attname, field
+
+    def get_position_filter(self, position):
+        # Лексикографическое сравнение кортежей:
+        # (a, b) > (x, y) <=> a > x OR (a = x AND b > y)
+        condition = Q()
+        for index, field_name in enumerate(self.ordering):
+            lookup = 'lt' if field_name.startswith('-') else 'gt'
+            equal = {
+                self.fields[i][0]: position[i] for i in range(index)
+            }
+            equal[f'{self.fields[index][0]}__{lookup}'] = position[index]
+            condition |= Q(**equal)
+        # Дизъюнкция сама по себе не задает начало диапазона индекса:
+        # PostgreSQL читал бы индекс с начала. Условие на первое поле
+        # (pub_date <= x) ограничивает диапазон, не меняя результат
+        lookup = 'lte' if self.ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{self.fields[0][0]}__{lookup}': position[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [
+                field.to_python(value)
+                for (_, field), value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def to_json(value):
+        # Даты и время без потери точности, Decimal строкой
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+    def encode_cursor(self, obj):
+        # obj — объект модели или строка .values()
+        values = [
+            self.to_json(obj[name] if isinstance(obj, dict)
+                         else getattr(obj, name))
+            for name, _ in self.fields
+        ]
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode()
+        ).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
 
 
 class CustomPagination(PageNumberPagination):
+    '''Постраничная пагинация с опциональным режимом курсора.
+
+    Если в запросе передан параметр cursor (в том числе пустой для первой
+    страницы), пагинация выполняется классом cursor_pagination_class.
+    '''
+
     page_size = settings.PAGE_SIZE
     page_size_query_param = 'limit'
+    cursor_pagination_class = KeysetPagination
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_param = self.cursor_pagination_class.cursor_query_param
+        if cursor_param in request.query_params:
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,12 +1,19 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.shortcuts import get_object_or_404
+from django.core.files.storage import default_storage
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import exceptions, serializers
 
-from recipes.models import (AmountIngredient, Favorite, Ingredient,
-                            Recipe, ShoppingCart, Tag)
-from users.models import Follow
+from recipes.counters import change_counter
+from recipes.feed import fan_out_recipe
+from recipes.images import IMAGE_FORMATS, IMAGE_SIZES, schedule_recipe_image
+from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
+from recipes.search import schedule_search_index
+from recipes.shopping_list import update_recipe_in_shopping_lists
+from .fields import HashedBase64ImageField
+from .utils import get_recipes_limit
+from .viewer import get_viewer_context
 
 
 User = get_user_model()
@@ -35,15 +42,17 @@ class UserSerializer(UserSerializer):
         fields = (
             'email', 'id',
             'username', 'first_name',
-            'last_name', 'is_subscribed'
+            'last_name', 'is_subscribed',
+            'recipes_count', 'followers_count'
         )
+        read_only_fields = ('recipes_count', 'followers_count')
 
     # Метод для получения значения поля is_subscribed
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
+        viewer = get_viewer_context(self.context.get('request'))
+        if viewer is None:
             return False
-        return Follow.objects.filter(user=request.user, author=obj.id).exists()
+        return obj.id in viewer.following_ids
 
 
 class UserCreateSerializer(UserCreateSerializer):
@@ -85,27 +94,38 @@ class GetIngredientInRecipeSerializer(serializers.ModelSerializer):
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
-    recipes = ShortRecipeSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes = serializers.SerializerMethodField(read_only=True)
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
-    # Методы для получения значений полей
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+    # Методы для получения значений полей.
+    # Списки подписок заранее подгружают рецепты и аннотируют подписку,
+    # для одиночного автора значения вычисляются запросами
+    def get_recipes(self, obj):
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
+        return ShortRecipeSerializer(
+            recipes, many=True, context=self.context
+        ).data
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        viewer = get_viewer_context(self.context.get('request'))
         # Если запрос не существует или пользователь анонимный
-        if request is None or request.user.is_anonymous:
+        if viewer is None:
             return False
-        # Проверяем, существует ли подписка пользователя на данного автора
-        return Follow.objects.filter(user=request.user, author=obj.id).exists()
+        # Проверяем, есть ли автор среди подписок пользователя
+        return obj.id in viewer.following_ids
 
     class Meta:
         model = User
         fields = ('id', 'email', 'username', 'first_name',
                   'last_name', 'is_subscribed', 'recipes',
-                  "recipes", 'recipes_count')
+                  "recipes", 'recipes_count', 'followers_count')
 
 
 class GetRecipeSerializer(serializers.ModelSerializer):
@@ -116,32 +136,51 @@ class GetRecipeSerializer(serializers.ModelSerializer):
     ingredients = serializers.SerializerMethodField(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    images = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'images', 'text',
+                  'cooking_time', 'favorites_count', 'shopping_cart_count')
 
     # Методы для получения значений полей
     def get_ingredients(self, obj):
-        ingredients = AmountIngredient.objects.filter(recipe=obj)
+        # Ингредиенты берутся из prefetch_related, если он был выполнен
+        ingredients = obj.recipes.all()
         serializer = GetIngredientInRecipeSerializer(ingredients, many=True)
         return serializer.data
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
+        viewer = get_viewer_context(self.context.get('request'))
+        if viewer is None:
             return False
-        return (ShoppingCart.objects.filter(user=request.user,
-                                            recipe=obj.id).exists())
+        return obj.id in viewer.shopping_cart_ids
 
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
+        viewer = get_viewer_context(self.context.get('request'))
+        if viewer is None:
             return False
-        return (Favorite.objects.filter(user=request.user,
-                                        recipe=obj.id).exists())
+        return obj.id in viewer.favorite_ids
+
+    def get_images(self, obj):
+        # Адреса производных изображений. Пока фоновая обработка
+        # не закончена, вместо них отдается оригинал
+        if not obj.image:
+            return None
+        request = self.context.get('request')
+        original = obj.image.url
+        images = {}
+        for size in IMAGE_SIZES:
+            variants = obj.image_variants.get(size, {})
+            images[size] = {}
+            for extension in IMAGE_FORMATS:
+                url = (default_storage.url(variants[extension])
+                       if extension in variants else original)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                images[size][extension] = url
+        return images
 
 
 class PostRecipeSerializer(serializers.ModelSerializer):
@@ -149,7 +188,7 @@ class PostRecipeSerializer(serializers.ModelSerializer):
 
     author = UserSerializer(read_only=True)
     ingredients = ShortIngredientSerializerForRecipe(many=True)
-    image = Base64ImageField()
+    image = HashedBase64ImageField()
     cooking_time = serializers.IntegerField()
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
@@ -182,6 +221,16 @@ class PostRecipeSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError(
                     'Количество каждого ингредиента должно быть больше 0'
                 )
+        # Проверка существования всех ингредиентов одним запросом
+        existing_ids = set(Ingredient.objects.filter(
+            id__in=ingredients_id_set
+        ).order_by().values_list('id', flat=True))
+        unknown_ids = sorted(ingredients_id_set - existing_ids)
+        if unknown_ids:
+            raise serializers.ValidationError(
+                'Не найдены ингредиенты с id: '
+                + ', '.join(map(str, unknown_ids))
+            )
         return ingredients
 
     def validate_cooking_time(self, cooking_time):
@@ -192,22 +241,58 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         return cooking_time
 
     def create_ingredients(self, ingredients, recipe):
-        recipe_ingredients = []
-        for ingredient in ingredients:
-            amount = ingredient['amount']
-            ingredient_id = ingredient['id']
-            ingredient = get_object_or_404(Ingredient, pk=ingredient_id)
-
-            recipe_ingredients.append(
-                AmountIngredient(
-                    recipe=recipe,
-                    ingredient=ingredient,
-                    amount=amount
-                )
+        # Существование ингредиентов проверено в validate_ingredients
+        AmountIngredient.objects.bulk_create(
+            AmountIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient['id'],
+                amount=ingredient['amount']
             )
-        AmountIngredient.objects.bulk_create(recipe_ingredients)
+            for ingredient in ingredients
+        )
+
+    def update_ingredients(self, ingredients, recipe):
+        # Сравниваем старый и новый состав рецепта и выполняем только
+        # нужные вставки, изменения и удаления. Возвращает старый состав
+        current = {
+            amount.ingredient_id: amount
+            for amount in AmountIngredient.objects.filter(recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: amount.amount
+            for ingredient_id, amount in current.items()
+        }
+        new_amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed_ids = current.keys() - new_amounts.keys()
+        if removed_ids:
+            AmountIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed_ids
+            ).delete()
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            if (ingredient_id in current
+                    and current[ingredient_id].amount != amount):
+                current[ingredient_id].amount = amount
+                changed.append(current[ingredient_id])
+        if changed:
+            AmountIngredient.objects.bulk_update(changed, ['amount'])
+        added = [
+            ingredient for ingredient in ingredients
+            if ingredient['id'] not in current
+        ]
+        if added:
+            self.create_ingredients(added, recipe)
+            # Поисковый индекс обновляют сигналы recipes.signals, но
+            # bulk_create их не вызывает. При создании рецепта это делает
+            # сигнал сохранения самого рецепта
+            schedule_search_index([recipe.id])
+        return old_amounts
 
     # Создание и обновление рецепта
+    @transaction.atomic
     def create(self, validated_data):
         # Получение автора рецепта из контекста запроса
         author = self.context.get('request').user
@@ -216,11 +301,22 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         # Создание объекта рецепта и присвоение тегов
         recipe = Recipe.objects.create(author=author, **validated_data)
+        # Счетчик обновляется до чтения режима ленты автора: UPDATE
+        # блокирует строку автора (см. recipes.feed.resume_fanout)
+        change_counter(User, author.pk, 'recipes_count', 1)
+        author.refresh_from_db(
+            fields=['recipes_count', 'followers_count', 'feed_fanout_on_read']
+        )
         recipe.tags.set(tags)
         # Создание связей между рецептом и ингредиентами
         self.create_ingredients(ingredients, recipe)
+        # Рецепт попадает в ленты подписчиков автора
+        fan_out_recipe(recipe)
+        # Производные размеры изображения создаются в фоне
+        schedule_recipe_image(recipe.image.name)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         # Обновление тегов рецепта при их наличии
         tags = validated_data.pop('tags', None)
@@ -229,11 +325,30 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         # Обновление ингредиентов рецепта при их наличии
         ingredients = validated_data.pop('ingredients', None)
         if ingredients is not None:
-            instance.ingredients.clear()
-            self.create_ingredients(ingredients, instance)
+            old_amounts = self.update_ingredients(ingredients, instance)
+            # Переносим изменение состава в списки покупок
+            update_recipe_in_shopping_lists(
+                instance,
+                old_amounts,
+                {item['id']: item['amount'] for item in ingredients},
+            )
 
-        # Вызов стандартного метода обновления для остальных полей
-        return super().update(instance, validated_data)
+        # Новое изображение обрабатывается в фоне, до этого отдается
+        # оригинал
+        image = validated_data.get('image')
+        image_changed = image is not None and image != instance.image.name
+        if image_changed:
+            validated_data['image_variants'] = {}
+
+        # Сохраняются только переданные поля: полный save() записал бы
+        # прочитанные до изменения счетчики и популярность поверх
+        # параллельных добавлений в избранное и корзину
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=validated_data.keys())
+        if image_changed:
+            schedule_recipe_image(instance.image.name)
+        return instance
 
     # Представление данных в виде объекта GetRecipeSerializer
     def to_representation(self, instance):
@@ -244,4 +359,19 @@ class PostRecipeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        exclude = ('pub_date',)
+        exclude = ('pub_date', 'image_variants', 'search_vector',
+                   'favorites_count', 'shopping_cart_count')
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    '''Список id для пакетных действий.'''
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS,
+    )
+
+    def validate_ids(self, ids):
+        # Повторы не меняют результат, порядок сохраняется для ответа
+        return list(dict.fromkeys(ids))
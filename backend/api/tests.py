@@ -0,0 +1,652 @@
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.feed import fan_out_recipe, resume_fanout
+from recipes.image_cache import RESCAN_FRACTION, ImageCache
+from recipes.models import (AmountIngredient, Favorite, Ingredient, Recipe,
+                            ShoppingCart, Tag)
+from recipes.relations import (delete_relation, delete_relations,
+                               insert_relation, insert_relations)
+from recipes.trending import update_trending
+from users.models import Follow
+from . import views
+
+User = get_user_model()
+
+AUTHORS = 8
+RECIPES_PER_AUTHOR = 4
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class QueryCountTests(TestCase):
+    '''Число запросов к БД не должно зависеть от размера страницы.
+
+    Каждый адрес запрашивается с маленькой и большой страницей, и для
+    большой ожидается столько же запросов, сколько для маленькой.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Тестовый', password='x',
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}')
+            for number in range(3)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(5)
+        )
+        for number in range(AUTHORS):
+            author = User.objects.create_user(
+                email=f'author{number}@example.com',
+                username=f'author{number}',
+                first_name='Автор', last_name=str(number), password='x',
+            )
+            Follow.objects.create(user=cls.reader, author=author)
+            for index in range(RECIPES_PER_AUTHOR):
+                recipe = Recipe.objects.create(
+                    author=author,
+                    name=f'Рецепт {number}-{index}',
+                    text='Описание',
+                    cooking_time=10,
+                    image='recipes/test.png',
+                )
+                recipe.tags.set(tags[:index % 3 + 1])
+                AmountIngredient.objects.bulk_create(
+                    AmountIngredient(
+                        recipe=recipe, ingredient=ingredient, amount=10
+                    )
+                    for ingredient in ingredients[:index + 1]
+                )
+                if index % 2:
+                    Favorite.objects.create(user=cls.reader, recipe=recipe)
+                else:
+                    ShoppingCart.objects.create(
+                        user=cls.reader, recipe=recipe
+                    )
+        cls.small_recipe = Recipe.objects.get(name='Рецепт 0-0')
+        cls.large_recipe = Recipe.objects.get(
+            name=f'Рецепт 0-{RECIPES_PER_AUTHOR - 1}'
+        )
+
+    def get_clients(self):
+        anonymous = APIClient()
+        authenticated = APIClient()
+        authenticated.force_authenticate(self.reader)
+        return {'anonymous': anonymous, 'authenticated': authenticated}
+
+    def get(self, client, url):
+        # Кэши (контекст пользователя, токены) сбрасываются, чтобы оба
+        # запроса выполнялись одинаково
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response.json(), len(queries)
+
+    def assert_same_queries(self, client, small_url, large_url):
+        _, expected = self.get(client, small_url)
+        cache.clear()
+        with self.assertNumQueries(expected):
+            response = client.get(large_url)
+        self.assertEqual(response.status_code, 200, large_url)
+        return response.json()
+
+    def test_recipe_list(self):
+        for fast in (False, True):
+            for name, client in self.get_clients().items():
+                with self.subTest(fast=fast, client=name), override_settings(
+                    API_FAST_SERIALIZATION=fast
+                ):
+                    data = self.assert_same_queries(
+                        client,
+                        '/api/recipes/?limit=2',
+                        '/api/recipes/?limit=20',
+                    )
+                    self.assertEqual(len(data['results']), 20)
+
+    def test_fast_serialization_bytes(self):
+        # Быстрая сериализация отдает те же байты, что и DRF
+        for name, client in self.get_clients().items():
+            for url in ('/api/recipes/?limit=20', '/api/recipes/?cursor=',
+                        '/api/recipes/?ordering=-cooking_time&page=2',
+                        '/api/tags/', '/api/ingredients/'):
+                with self.subTest(client=name, url=url):
+                    contents = []
+                    for fast in (False, True):
+                        cache.clear()
+                        with override_settings(API_FAST_SERIALIZATION=fast):
+                            response = client.get(url)
+                        self.assertEqual(response.status_code, 200)
+                        contents.append(response.content)
+                    self.assertEqual(contents[0], contents[1])
+        client = self.get_clients()['authenticated']
+        contents = []
+        for fast in (False, True):
+            with override_settings(API_FAST_SERIALIZATION=fast):
+                contents.append(client.get('/api/recipes/feed/').content)
+        self.assertEqual(contents[0], contents[1])
+
+    def test_recipe_list_cursor(self):
+        for name, client in self.get_clients().items():
+            with self.subTest(client=name):
+                data = self.assert_same_queries(
+                    client,
+                    '/api/recipes/?cursor=&limit=2',
+                    '/api/recipes/?cursor=&limit=20',
+                )
+                self.assertEqual(len(data['results']), 20)
+
+    @override_settings(API_FAST_SERIALIZATION=True)
+    def test_recipe_list_columns(self):
+        # Быстрая сериализация не выбирает служебные столбцы рецепта
+        client = self.get_clients()['anonymous']
+        for url in ('/api/recipes/?limit=2', '/api/recipes/?cursor=&limit=2'):
+            with self.subTest(url=url), CaptureQueriesContext(
+                connection
+            ) as queries:
+                self.assertEqual(client.get(url).status_code, 200)
+                page = [
+                    query['sql'] for query in queries.captured_queries
+                    if '"cooking_time"' in query['sql']
+                ]
+                self.assertEqual(len(page), 1)
+                for column in ('search_vector', 'trending_score'):
+                    self.assertNotIn(f'"{column}"', page[0].split('FROM')[0])
+
+    def test_cursor_pages(self):
+        # Курсор проходит все рецепты в порядке сортировки без пропусков
+        # и повторов, в том числе при равных значениях первого поля
+        client = self.get_clients()['anonymous']
+        for ordering in ('', '&ordering=cooking_time',
+                         '&ordering=-favorites_count'):
+            with self.subTest(ordering=ordering):
+                expected = [
+                    recipe['id'] for recipe in client.get(
+                        f'/api/recipes/?limit=100{ordering}'
+                    ).json()['results']
+                ]
+                seen = []
+                url = f'/api/recipes/?cursor=&limit=3{ordering}'
+                while url:
+                    with CaptureQueriesContext(connection) as queries:
+                        data = client.get(url).json()
+                    if seen:
+                        # Диапазон индекса ограничен по первому полю
+                        self.assertRegex(
+                            queries.captured_queries[0]['sql'],
+                            r'[<>]= \S+ AND \(',
+                        )
+                    seen += [recipe['id'] for recipe in data['results']]
+                    url = data['next']
+                self.assertEqual(seen, expected)
+                self.assertEqual(len(seen), AUTHORS * RECIPES_PER_AUTHOR)
+
+    def test_recipe_detail(self):
+        # Рецепты с одним и с несколькими тегами и ингредиентами
+        for name, client in self.get_clients().items():
+            with self.subTest(client=name):
+                data = self.assert_same_queries(
+                    client,
+                    f'/api/recipes/{self.small_recipe.id}/',
+                    f'/api/recipes/{self.large_recipe.id}/',
+                )
+                self.assertEqual(
+                    len(data['ingredients']), RECIPES_PER_AUTHOR
+                )
+
+    def test_subscriptions(self):
+        client = self.get_clients()['authenticated']
+        data = self.assert_same_queries(
+            client,
+            '/api/users/subscriptions/?limit=2&recipes_limit=1',
+            f'/api/users/subscriptions/?limit={AUTHORS}'
+            f'&recipes_limit={RECIPES_PER_AUTHOR}',
+        )
+        self.assertEqual(len(data['results']), AUTHORS)
+        self.assertEqual(
+            len(data['results'][0]['recipes']), RECIPES_PER_AUTHOR
+        )
+
+    def test_me_from_token_cache(self):
+        # После первого запроса токен с пользователем берется из кэша,
+        # строка пользователя заново не читается
+        cache.clear()
+        token = Token.objects.create(user=self.reader)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(client.get('/api/users/me/').status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            data = client.get('/api/users/me/').json()
+        self.assertEqual(data['id'], self.reader.id)
+        # Остается только множество подписок для is_subscribed
+        for query in queries.captured_queries:
+            self.assertNotIn('users_user', query['sql'])
+            self.assertNotIn('authtoken_token', query['sql'])
+
+    def test_invalid_recipes_limit(self):
+        client = self.get_clients()['authenticated']
+        for limit in ('0', '-1', 'abc', '²', '1.5'):
+            with self.subTest(limit=limit):
+                response = client.get(
+                    f'/api/users/subscriptions/?recipes_limit={limit}'
+                )
+                self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class ConditionalTests(TestCase):
+    '''Условный GET справочников: 304 без запросов к базе.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Завтрак', color='#000001', slug='breakfast')
+        Ingredient.objects.create(name='Мука', measurement_unit='г')
+        Ingredient.objects.create(name='Молоко', measurement_unit='мл')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_not_modified(self):
+        for url in ('/api/tags/', '/api/ingredients/',
+                    '/api/ingredients/?name=мо'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=etag
+                    )
+                self.assertEqual(response.status_code, 304)
+                # У другого адреса свой ETag
+                response = self.client.get(
+                    url + ('&' if '?' in url else '?') + 'limit=1',
+                    HTTP_IF_NONE_MATCH=etag,
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_changed_after_write(self):
+        url = '/api/ingredients/?name=мо'
+        etag = self.client.get(url)['ETag']
+        Ingredient.objects.create(name='Морковь', measurement_unit='г')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+
+class FeedModeTests(TestCase):
+    '''Рецепты автора не пропадают из ленты при смене режима.'''
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тестовый', password='x',
+        )
+        self.readers = [
+            User.objects.create_user(
+                email=f'reader{number}@example.com',
+                username=f'reader{number}',
+                first_name='Читатель', last_name=str(number), password='x',
+            )
+            for number in range(3)
+        ]
+        for reader in self.readers:
+            Follow.objects.create(user=reader, author=self.author)
+        User.objects.filter(id=self.author.id).update(followers_count=3)
+        self.author.refresh_from_db()
+        self.client = APIClient()
+        self.client.force_authenticate(self.readers[0])
+
+    def get_feed_ids(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def publish(self, name, limit):
+        recipe = Recipe.objects.create(
+            author=self.author, name=name, text='Описание',
+            cooking_time=10, image='recipes/test.png',
+        )
+        fan_out_recipe(recipe, limit)
+        return recipe.id
+
+    def test_author_drops_below_limit(self):
+        written = self.publish('По записи', limit=3)
+        # Подписчиков больше лимита: рецепт выбирается при чтении
+        on_read = self.publish('По чтению', limit=2)
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.feed_fanout_on_read)
+        self.assertEqual(self.get_feed_ids(), [on_read, written])
+        # Подписчиков стало меньше лимита, режим сохраняется, пока
+        # рецепты не дописаны в ленты
+        Follow.objects.filter(user=self.readers[2]).delete()
+        User.objects.filter(id=self.author.id).update(followers_count=2)
+        self.assertEqual(self.get_feed_ids(), [on_read, written])
+        self.assertEqual(resume_fanout(limit=2), 0)
+        self.assertEqual(resume_fanout(limit=3), 1)
+        self.author.refresh_from_db()
+        self.assertFalse(self.author.feed_fanout_on_read)
+        self.assertEqual(self.get_feed_ids(), [on_read, written])
+
+
+class ImageCacheTests(SimpleTestCase):
+    '''Дисковый кэш изображений, общий для нескольких воркеров.'''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+
+    def test_size_limit_shared_by_workers(self):
+        max_bytes = 100 * 1000
+        workers = [ImageCache(self.root, max_bytes) for _ in range(4)]
+        peak = 0
+        for number in range(1200):
+            workers[number % len(workers)].put(
+                f'image{number}/card.webp', b'x' * 1000
+            )
+            peak = max(peak, workers[0].get_total_size())
+        self.assertLessEqual(
+            peak, max_bytes * (1 + RESCAN_FRACTION * len(workers))
+        )
+
+    def test_keys_differ_by_extension(self):
+        cache = ImageCache(self.root, 10 ** 6)
+        paths = {
+            cache.get_relative_path(name, 'card', 'webp')
+            for name in ('recipes/photo.jpg', 'recipes/photo.png',
+                         'legacy/photo.jpg')
+        }
+        self.assertEqual(len(paths), 3)
+
+
+class RelationTests(TestCase):
+    '''Избранное, корзина и подписки без дублей и с точными счетчиками.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Пользователь', last_name='Тестовый', password='x',
+        )
+        cls.authors = [
+            User.objects.create_user(
+                email=f'author{number}@example.com',
+                username=f'author{number}',
+                first_name='Автор', last_name=str(number), password='x',
+            )
+            for number in range(2)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.authors[0], name=f'Рецепт {number}',
+                text='Описание', cooking_time=10, image='recipes/test.png',
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_insert_and_delete_relations(self):
+        ids = [recipe.id for recipe in self.recipes]
+        self.assertTrue(
+            insert_relation(Favorite, user=self.user, recipe=self.recipes[0])
+        )
+        self.assertFalse(
+            insert_relation(Favorite, user=self.user, recipe=self.recipes[0])
+        )
+        # Вставляются и возвращаются только новые связи
+        self.assertEqual(
+            insert_relations(Favorite, 'recipe', ids, user=self.user),
+            set(ids[1:]),
+        )
+        self.assertEqual(
+            insert_relations(Favorite, 'recipe', ids, user=self.user), set()
+        )
+        self.assertEqual(Favorite.objects.filter(user=self.user).count(), 3)
+        self.assertTrue(
+            delete_relation(Favorite, user=self.user, recipe=self.recipes[0])
+        )
+        self.assertFalse(
+            delete_relation(Favorite, user=self.user, recipe=self.recipes[0])
+        )
+        self.assertEqual(
+            delete_relations(Favorite, 'recipe', ids, user=self.user),
+            set(ids[1:]),
+        )
+        self.assertEqual(
+            delete_relations(Favorite, 'recipe', ids, user=self.user), set()
+        )
+        self.assertFalse(Favorite.objects.filter(user=self.user).exists())
+
+    def test_bulk_statuses_and_counters(self):
+        recipe = self.recipes[0]
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        ids = [recipe.id for recipe in self.recipes]
+        for method, expected, total in (
+            ('post', ['exists', 'created', 'created'], 1),
+            ('post', ['exists', 'exists', 'exists'], 1),
+            ('delete', ['deleted', 'deleted', 'deleted'], 0),
+            ('delete', ['missing', 'missing', 'missing'], 0),
+        ):
+            with self.subTest(method=method, expected=expected):
+                response = getattr(self.client, method)(
+                    '/api/recipes/favorite/', {'ids': ids}, format='json'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    [item['status'] for item in response.json()['results']],
+                    expected,
+                )
+                self.assertEqual(list(Recipe.objects.filter(
+                    id__in=ids
+                ).order_by('id').values_list(
+                    'favorites_count', flat=True
+                )), [total] * 3)
+
+    def test_bulk_unknown_ids(self):
+        unknown = Recipe.objects.order_by('-id').first().id + 1
+        recipe_ids = [self.recipes[0].id, unknown]
+        author_ids = [self.authors[0].id, User.objects.count() + 100]
+        for method in ('post', 'delete'):
+            for path, ids in (
+                ('/api/recipes/favorite/', recipe_ids),
+                ('/api/recipes/shopping_cart/', recipe_ids),
+                ('/api/users/subscribe/', author_ids),
+            ):
+                with self.subTest(method=method, path=path):
+                    response = getattr(self.client, method)(
+                        path, {'ids': ids}, format='json'
+                    )
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(str(ids[1]), response.json()['ids'][0])
+        # Известные id из отклоненного запроса тоже не записаны
+        self.assertFalse(Favorite.objects.exists())
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(Follow.objects.exists())
+
+
+class TrendingTests(TestCase):
+    '''Сортировка по популярности после добавлений в избранное.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', username=f'user{number}',
+                first_name='Пользователь', last_name=str(number),
+                password='x',
+            )
+            for number in range(3)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.users[0], name=f'Рецепт {number}',
+                text='Описание', cooking_time=10, image='recipes/test.png',
+            )
+            for number in range(3)
+        ]
+
+    def favorite(self, user, recipe):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(response.status_code, 201)
+
+    def get_trending_ids(self):
+        response = APIClient().get('/api/recipes/?ordering=trending')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_order_after_favorites(self):
+        first, second, third = self.recipes
+        now = timezone.now()
+        for user in self.users[:2]:
+            self.favorite(user, second)
+        self.favorite(self.users[0], first)
+        Favorite.objects.update(created=now - timedelta(minutes=10))
+        self.assertEqual(update_trending(now=now), 2)
+        self.assertEqual(
+            self.get_trending_ids(), [second.id, first.id, third.id]
+        )
+        # Новые события прибавляются к сохраненной популярности
+        for user in self.users[1:]:
+            self.favorite(user, first)
+        self.assertEqual(update_trending(now=now + timedelta(minutes=2)), 1)
+        self.assertEqual(
+            self.get_trending_ids(), [first.id, second.id, third.id]
+        )
+
+
+class CommandTests(TestCase):
+    '''Нагрузочный прогон на сгенерированных данных проходит без ошибок.'''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        cache.clear()
+
+    def test_seed_data_and_benchmark(self):
+        output = os.path.join(self.root, 'report.json')
+        with override_settings(
+            MEDIA_ROOT=self.root,
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+            }},
+        ), mock.patch.object(
+            views, 'image_cache',
+            ImageCache(os.path.join(self.root, 'image_cache'), 10 ** 6),
+        ):
+            call_command(
+                'seed_data', users=6, recipes=12, favorites=2, carts=1,
+                follows=1, images=1, stdout=io.StringIO(),
+            )
+            call_command(
+                'benchmark_api', iterations=2, warmup=0, output=output,
+                stdout=io.StringIO(),
+            )
+        with open(output, encoding='utf-8') as file:
+            report = json.load(file)
+        self.assertEqual(report['meta']['dataset']['recipes'], 12)
+        errors = {
+            name: endpoint['statuses']
+            for name, endpoint in report['endpoints'].items()
+            if endpoint['errors']
+        }
+        self.assertEqual(errors, {})
+        # Пользователи, созданные прогоном, удалены
+        self.assertFalse(
+            User.objects.filter(email__startswith='benchmark').exists()
+        )
+
+
+class ConcurrentDeleteTests(TransactionTestCase):
+    '''Рецепт или автор, удаленные между проверкой и коммитом.
+
+    Внешний ключ проверяется при коммите, поэтому нужна настоящая
+    транзакция, а не TestCase.
+    '''
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Пользователь', last_name='Тестовый', password='x',
+        )
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тестовый', password='x',
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/test.png',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def delete_before(self, function, model, pk):
+        # Объект удаляется сразу после проверки существования
+        def wrapper(*args, **kwargs):
+            model.objects.filter(pk=pk).delete()
+            return function(*args, **kwargs)
+        return wrapper
+
+    def test_recipe_deleted(self):
+        for path, name, status in (
+            (f'/api/recipes/{self.recipe.id}/favorite/',
+             'insert_relation', 404),
+            ('/api/recipes/favorite/', 'insert_relations', 400),
+        ):
+            with self.subTest(path=path):
+                recipe = Recipe.objects.create(
+                    author=self.author, name='Рецепт', text='Описание',
+                    cooking_time=10, image='recipes/test.png',
+                )
+                path = path.replace(str(self.recipe.id), str(recipe.id))
+                function = getattr(views, name)
+                with mock.patch(f'api.views.{name}', self.delete_before(
+                    function, Recipe, recipe.id
+                )):
+                    response = self.client.post(
+                        path, {'ids': [recipe.id]}, format='json'
+                    )
+                self.assertEqual(response.status_code, status)
+        self.assertFalse(Favorite.objects.exists())
+
+    def test_author_deleted(self):
+        with mock.patch('api.views.insert_relations', self.delete_before(
+            views.insert_relations, User, self.author.id
+        )):
+            response = self.client.post(
+                '/api/users/subscribe/', {'ids': [self.author.id]},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Follow.objects.exists())
@@ -1,7 +1,8 @@
 from django.urls import include, path, re_path
 from rest_framework import routers
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from .views import (IngredientViewSet, MetricsView, RecipeViewSet,
+                    TagViewSet, UserViewSet)
 
 app_name = 'api'
 
@@ -14,6 +15,7 @@ router.register('ingredients', IngredientViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('auth/', include('djoser.urls')),
     re_path('auth/', include('djoser.urls.authtoken'))
 ]
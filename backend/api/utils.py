@@ -1,32 +1,116 @@
-from django.db.models import Sum
+import csv
+import json
+import re
 
-from recipes.models import AmountIngredient, ShoppingCart
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from rest_framework import exceptions
 
+from recipes.models import ShoppingListItem
 
-def create_ingredient_list(user):
-    # Получаем список рецептов в корзине пользователя
-    shopping_cart = ShoppingCart.objects.filter(user=user)
-    recipe_ids = shopping_cart.values_list('recipe', flat=True)
+# Количество строк, читаемых из базы за один раз
+SHOPPING_LIST_CHUNK_SIZE = 2000
+# Размер фрагмента потокового ответа в символах
+SHOPPING_LIST_BUFFER_SIZE = 64 * 1024
 
-    # Получаем ингредиенты и их количество для рецептов из списка покупок
-    ingredients = AmountIngredient.objects.filter(
-        recipe__in=recipe_ids
-    ).values(
+
+def get_recipes_limit(request):
+    # Значение параметра recipes_limit или None, если он не передан
+    if request is None:
+        return None
+    limit = request.query_params.get('recipes_limit')
+    if limit is None or limit == '':
+        return None
+    # isdigit() пропускает символы вроде '²', на которых int() падает
+    if not re.fullmatch(r'[0-9]+', limit) or int(limit) < 1:
+        raise exceptions.ValidationError(
+            {'recipes_limit': 'Должно быть целым положительным числом'})
+    return int(limit)
+
+
+def send_file(path, url, content_type):
+    # За nginx отдаем только заголовок X-Accel-Redirect с адресом файла,
+    # сами байты nginx читает с диска
+    if settings.USE_X_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = url
+        return response
+    return FileResponse(open(path, 'rb'), content_type=content_type)
+
+
+def get_shopping_list_rows(user):
+    # Готовый сводный список покупок пользователя читается одним
+    # диапазонным запросом по индексу (user, ingredient).
+    # iterator() читает строки порциями (на PostgreSQL — серверным
+    # курсором), не загружая весь результат в память
+    return ShoppingListItem.objects.filter(user=user).values(
         'ingredient__name',
-        'ingredient__measurement_unit'
-    ).annotate(amount=Sum('amount'))
-
-    # Создаем заголовок для списка покупок
-    shopping_list_final = 'Shopping List\n'
-
-    # Добавляем в список каждый ингредиент с его количеством и
-    # единицами измерения
-    for item in ingredients:
-        ingredient_name = item['ingredient__name']
-        measurement_unit = item['ingredient__measurement_unit']
-        amount = item['amount']
-        shopping_list_final += (
-            f'{ingredient_name} '
-            f'({measurement_unit}) {amount}\n'
+        'ingredient__measurement_unit',
+        'amount',
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+
+
+def iter_txt(rows):
+    yield 'Shopping List\n'
+    for item in rows:
+        yield (
+            f'{item["ingredient__name"]} '
+            f'({item["ingredient__measurement_unit"]}) {item["amount"]}\n'
         )
-    return shopping_list_final
+
+
+def iter_csv(rows):
+    # csv.writer пишет в буфер, который просто возвращает строку
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for item in rows:
+        yield writer.writerow((
+            item['ingredient__name'],
+            item['ingredient__measurement_unit'],
+            item['amount'],
+        ))
+
+
+def iter_json(rows):
+    separator = '['
+    for item in rows:
+        yield separator + json.dumps({
+            'name': item['ingredient__name'],
+            'measurement_unit': item['ingredient__measurement_unit'],
+            'amount': item['amount'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+class _EchoBuffer:
+    def write(self, value):
+        return value
+
+
+# Формат файла: (content type, расширение, генератор строк)
+SHOPPING_LIST_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', 'txt', iter_txt),
+    'csv': ('text/csv; charset=utf-8', 'csv', iter_csv),
+    'json': ('application/json', 'json', iter_json),
+}
+
+
+def create_ingredient_list(user, file_format='txt'):
+    # Генератор списка покупок в выбранном формате. Строки объединяются
+    # во фрагменты фиксированного размера, поэтому расход памяти не
+    # зависит от размера корзины
+    _, _, iter_lines = SHOPPING_LIST_FORMATS[file_format]
+    buffer = []
+    size = 0
+    for line in iter_lines(get_shopping_list_rows(user)):
+        buffer.append(line)
+        size += len(line)
+        if size >= SHOPPING_LIST_BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
@@ -0,0 +1,50 @@
+from django.utils.functional import cached_property
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Follow
+
+
+class ViewerContext:
+    '''Избранное, корзина и подписки текущего пользователя.
+
+    Каждое множество id загружается одним запросом при первом обращении
+    и дальше используется всеми сериализаторами и фильтрами запроса.
+    '''
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def favorite_ids(self):
+        return frozenset(
+            Favorite.objects.filter(user=self.user)
+            .values_list('recipe_id', flat=True)
+        )
+
+    @cached_property
+    def shopping_cart_ids(self):
+        return frozenset(
+            ShoppingCart.objects.filter(user=self.user)
+            .values_list('recipe_id', flat=True)
+        )
+
+    @cached_property
+    def following_ids(self):
+        return frozenset(
+            Follow.objects.filter(user=self.user)
+            .values_list('author_id', flat=True)
+        )
+
+
+def get_viewer_context(request):
+    '''Возвращает контекст пользователя запроса или None для анонима.'''
+    if request is None or request.user.is_anonymous:
+        return None
+    # Храним контекст на исходном HttpRequest, чтобы он был общим
+    # для всех обёрток запроса DRF
+    http_request = getattr(request, '_request', request)
+    viewer = getattr(http_request, 'viewer_context', None)
+    if viewer is None or viewer.user != request.user:
+        viewer = ViewerContext(request.user)
+        http_request.viewer_context = viewer
+    return viewer
@@ -1,23 +1,57 @@
+from contextlib import contextmanager
+
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, Value
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.decorators import method_decorator
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
+from PIL import UnidentifiedImageError
 from rest_framework import exceptions, status
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
-from api.filters import FilterForIngredients, FilterForRecipes
-from recipes.models import (Favorite, Ingredient, Recipe,
+from api.filters import (FilterForIngredients, FilterForRecipes,
+                         StableOrderingFilter)
+from recipes.counters import (RECIPE_COUNTERS, change_counter,
+                              change_counters)
+from recipes.feed import (add_authors_to_feed, get_feed,
+                          remove_authors_from_feed)
+from recipes.image_cache import image_cache
+from recipes.images import (IMAGE_CONTENT_TYPES, IMAGE_FORMATS, IMAGE_SIZES,
+                            render_variant)
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (AmountIngredient, Favorite, Ingredient, Recipe,
                             ShoppingCart, Tag)
+from recipes.relations import (delete_relation, delete_relations,
+                               insert_relation, insert_relations)
+from recipes.shopping_list import (add_recipe_to_shopping_list,
+                                   add_recipes_to_shopping_list,
+                                   remove_recipe_from_all_shopping_lists,
+                                   remove_recipe_from_shopping_list,
+                                   remove_recipes_from_shopping_list)
 from users.models import Follow
-from .mixins import ListRetrieveMixin
+from .conditional import reference_data_cache
+from .fast_serializers import (RECIPE_FIELDS, serialize_recipes,
+                               serialize_values)
+from .middleware import endpoint_metrics
+from .mixins import ListRetrieveMixin, ServerTimingMixin
 from .pagination import CustomPagination
 from .permissions import IsAuthorOrReadOnly
-from .utils import create_ingredient_list
-from .serializers import (GetRecipeSerializer, IngredientSerializer,
+from .utils import (SHOPPING_LIST_FORMATS, create_ingredient_list,
+                    get_recipes_limit, send_file)
+from .serializers import (BulkIdsSerializer, GetRecipeSerializer,
+                          IngredientSerializer,
                           PostRecipeSerializer, ShortRecipeSerializer,
                           SubscriptionSerializer, TagSerializer,
                           UserSerializer)
@@ -25,24 +59,98 @@ from .serializers import (GetRecipeSerializer, IngredientSerializer,
 
 User = get_user_model()
 
+# Результаты пакетных действий для каждого id
+BULK_CREATED = 'created'
+BULK_DELETED = 'deleted'
+BULK_EXISTS = 'exists'
+BULK_MISSING = 'missing'
+BULK_SELF = 'self'
+BULK_DELETED_MESSAGE = 'Объекты удалены во время запроса, повторите его'
+
+
+def get_bulk_ids(request):
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data['ids']
+
+
+def check_bulk_ids(ids, found):
+    # Неизвестный id отклоняет весь запрос, ничего не записывается
+    unknown = [pk for pk in ids if pk not in found]
+    if unknown:
+        raise exceptions.ValidationError({'ids': [
+            'Объекты не найдены: ' + ', '.join(map(str, unknown))
+        ]})
+
 
+@contextmanager
+def relation_transaction(exception_class, detail):
+    '''Транзакция изменения связей с рецептами или авторами.
+
+    Объекты читаются до транзакции и могут быть удалены параллельным
+    запросом. Тогда внешний ключ новой связи нарушается при коммите,
+    и вместо ответа 500 вызывается exception_class(detail).
+    '''
+    try:
+        with transaction.atomic():
+            yield
+    except (IntegrityError, ObjectDoesNotExist):
+        raise exception_class(detail)
+
+
+def get_bulk_response(ids, statuses):
+    return Response({'results': [
+        {'id': pk, 'status': statuses[pk]} for pk in ids
+    ]})
+
+
+@method_decorator(reference_data_cache(Ingredient), name='list')
+@method_decorator(reference_data_cache(Ingredient), name='retrieve')
 class IngredientViewSet(ListRetrieveMixin):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
     filterset_class = FilterForIngredients
 
+    # Поиск по началу названия обслуживается индексом в памяти процесса
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        if settings.API_FAST_SERIALIZATION:
+            return Response(serialize_values(
+                self.filter_queryset(self.get_queryset()),
+                self.get_serializer_class(),
+            ))
+        return super().list(request, *args, **kwargs)
+
 
+@method_decorator(reference_data_cache(Tag), name='list')
+@method_decorator(reference_data_cache(Tag), name='retrieve')
 class TagViewSet(ListRetrieveMixin):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
 
+    def list(self, request, *args, **kwargs):
+        if settings.API_FAST_SERIALIZATION:
+            return Response(serialize_values(
+                self.filter_queryset(self.get_queryset()),
+                self.get_serializer_class(),
+            ))
+        return super().list(request, *args, **kwargs)
 
-class UserViewSet(UserViewSet):
+
+class UserViewSet(ServerTimingMixin, UserViewSet):
+    # /me/ отдает пользователя из кэша токенов (api.authentication) без
+    # запросов к базе, поэтому его счетчики могут отставать не больше
+    # чем на TOKEN_CACHE_TIMEOUT. Остальные адреса читают их из базы
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = CustomPagination
+    filter_backends = [StableOrderingFilter]
+    ordering_fields = ('id', 'followers_count', 'recipes_count')
+    ordering = ('id',)
 
     @action(
         detail=False,
@@ -52,12 +160,24 @@ class UserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = request.user
-        # Получение всех подписок пользователя
-        queryset = User.objects.filter(followings__user=user)
+        # Не более recipes_limit новейших рецептов каждого автора
+        # одним запросом с оконной функцией
+        recipes = Recipe.objects.order_by('-pub_date', '-id')
+        limit = get_recipes_limit(request)
+        if limit is not None:
+            recipes = recipes[:limit]
+        # Получение всех подписок пользователя в стабильном порядке.
+        # Подписка на каждого автора здесь заведомо есть
+        queryset = self.filter_queryset(
+            User.objects.filter(followings__user=user)
+        ).annotate(
+            is_subscribed=Value(True),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
         # Разбиение результатов на страницы
         pages = self.paginate_queryset(queryset)
-        serializer = self.serializer_class(
-            pages, many=True, context={'request': request})
+        serializer = self.get_serializer(pages, many=True)
         return self.get_paginated_response(serializer.data)
 
     @action(
@@ -68,40 +188,84 @@ class UserViewSet(UserViewSet):
     def subscribe(self, request, id=None):
         user = request.user
         author = get_object_or_404(User, pk=id)
-        # Поиск подписки пользователя на автора
-        follow_search = Follow.objects.filter(user=user, author=author)
 
         if request.method == 'POST':
-            return self.create_subscription(user, author, follow_search)
+            return self.create_subscription(user, author)
 
         if request.method == 'DELETE':
-            return self.delete_subscription(user, author, follow_search)
+            return self.delete_subscription(user, author)
 
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
-    def create_subscription(self, user, author, follow_search):
+    # Подписка на несколько авторов или отписка от них одним запросом
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='subscribe',
+        permission_classes=[IsAuthenticated],
+    )
+    def subscribe_bulk(self, request):
+        user = request.user
+        ids = get_bulk_ids(request)
+        # Транзакция начинается с записи: в SQLite транзакция, которая
+        # сначала читает, не может дождаться блокировки на запись
+        authors = set(User.objects.filter(
+            id__in=ids
+        ).values_list('id', flat=True))
+        check_bulk_ids(ids, authors)
+        statuses = {}
+        with relation_transaction(
+            exceptions.ValidationError, {'ids': [BULK_DELETED_MESSAGE]}
+        ):
+            # Результат определяется строками, которые действительно
+            # вставлены или удалены: параллельный запрос мог изменить
+            # те же подписки
+            if request.method == 'POST':
+                authors.discard(user.id)
+                added = insert_relations(
+                    Follow, 'author', [pk for pk in ids if pk in authors],
+                    user=user,
+                )
+                statuses.update(dict.fromkeys(authors, BULK_EXISTS))
+                statuses.update(dict.fromkeys(added, BULK_CREATED))
+                if user.id in ids:
+                    statuses[user.id] = BULK_SELF
+                change_counters(User, added, 'followers_count', 1)
+                add_authors_to_feed(user, added)
+            else:
+                deleted = delete_relations(Follow, 'author', ids, user=user)
+                statuses.update(dict.fromkeys(authors, BULK_MISSING))
+                statuses.update(dict.fromkeys(deleted, BULK_DELETED))
+                change_counters(User, deleted, 'followers_count', -1)
+                remove_authors_from_feed(user, deleted)
+        return get_bulk_response(ids, statuses)
+
+    def create_subscription(self, user, author):
         # Если пользователь пытается подписаться на самого себя
         if user == author:
             raise exceptions.ValidationError(
                 'Нельзя подписаться на самого себя')
-        # Если подписка уже существует
-        if follow_search.exists():
-            # Выводим ошибку
-            raise exceptions.ValidationError(
-                'Вы уже подписались на этого пользователя')
-        # Создание подписки
-        Follow.objects.create(user=user, author=author)
+        # Автор, удаленный параллельно, — как несуществующий
+        with relation_transaction(exceptions.NotFound, None):
+            # Если подписка уже существует, строка не вставляется
+            if not insert_relation(Follow, user=user, author=author):
+                raise exceptions.ValidationError(
+                    'Вы уже подписались на этого пользователя')
+            change_counter(User, author.pk, 'followers_count', 1)
+            author.refresh_from_db(fields=['followers_count'])
+            add_authors_to_feed(user, [author.id])
         serializer = self.get_serializer(author)
         # Возвращение ответа с сериализованными данными
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    def delete_subscription(self, user, author, follow_search):
-        # Если подписка не существует
-        if not follow_search.exists():
-            raise exceptions.ValidationError(
-                'Вы еще не подписаны на этого пользователя')
-        # Удаление подписки
-        Follow.objects.filter(user=user, author=author).delete()
+    def delete_subscription(self, user, author):
+        with transaction.atomic():
+            # Если подписка не существует, удалять нечего
+            if not delete_relation(Follow, user=user, author=author):
+                raise exceptions.ValidationError(
+                    'Вы еще не подписаны на этого пользователя')
+            change_counter(User, author.pk, 'followers_count', -1)
+            remove_authors_from_feed(user, [author.id])
         # Возвращение ответа без содержания (204 No Content)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -113,11 +277,16 @@ class FavoriteShoppingCart:
         user = request.user
         # Рецепт, который добавляется в избранное
         recipe = get_object_or_404(Recipe, pk=recipe_pk)
-        # Если рецепт уже находится в избранном у пользователя
-        if model.objects.filter(recipe=recipe, user=user).exists():
-            raise exceptions.ValidationError(error_message)
-        # Добавление рецепта в избранное
-        model.objects.create(user=user, recipe=recipe)
+        # Рецепт, удаленный параллельно, — как несуществующий
+        with relation_transaction(exceptions.NotFound, None):
+            # Если рецепт уже находится в избранном у пользователя,
+            # строка не вставляется
+            if not insert_relation(model, user=user, recipe=recipe):
+                raise exceptions.ValidationError(error_message)
+            change_counter(Recipe, recipe.pk, RECIPE_COUNTERS[model], 1)
+            # Корзина дополнительно меняет сводный список покупок
+            if model is ShoppingCart:
+                add_recipe_to_shopping_list(user, recipe)
         serializer = ShortRecipeSerializer(instance=recipe,
                                            context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -125,26 +294,126 @@ class FavoriteShoppingCart:
     @staticmethod
     def delete_method(model, recipe_pk, request, error_message):
         user = request.user
-        # Рецепт, который удаляется из избранного
-        recipe = get_object_or_404(Recipe, pk=recipe_pk)
-        # Если рецепт не находится в избранном у пользователя
-        if not model.objects.filter(user=user, recipe=recipe).exists():
-            raise exceptions.ValidationError(error_message)
-        # Удаление рецепта из избранного
-        model.objects.filter(user=user, recipe=recipe).delete()
+        with transaction.atomic():
+            # Рецепт ищется, только если удалять было нечего: для
+            # несуществующего рецепта ответ 404, иначе 400
+            if not delete_relation(model, user=user, recipe_id=recipe_pk):
+                get_object_or_404(Recipe, pk=recipe_pk)
+                raise exceptions.ValidationError(error_message)
+            change_counter(Recipe, recipe_pk, RECIPE_COUNTERS[model], -1)
+            if model is ShoppingCart:
+                remove_recipe_from_shopping_list(user, recipe_pk)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def bulk_method(model, request):
+        # Пакетное добавление (POST) или удаление (DELETE): одна вставка
+        # или одно удаление на все рецепты вместо запросов на каждый
+        user = request.user
+        ids = get_bulk_ids(request)
+        counter = RECIPE_COUNTERS[model]
+        # Рецепты читаются до транзакции, как в subscribe_bulk
+        recipes = set(Recipe.objects.filter(
+            id__in=ids
+        ).values_list('id', flat=True))
+        check_bulk_ids(ids, recipes)
+        statuses = {}
+        with relation_transaction(
+            exceptions.ValidationError, {'ids': [BULK_DELETED_MESSAGE]}
+        ):
+            # Счетчики и список покупок меняются только для строк,
+            # которые действительно вставлены или удалены, в том числе
+            # при параллельных одиночных запросах
+            if request.method == 'POST':
+                added = insert_relations(model, 'recipe', ids, user=user)
+                statuses.update(dict.fromkeys(recipes, BULK_EXISTS))
+                statuses.update(dict.fromkeys(added, BULK_CREATED))
+                change_counters(Recipe, added, counter, 1)
+                if model is ShoppingCart:
+                    add_recipes_to_shopping_list(user, added)
+            else:
+                deleted = delete_relations(model, 'recipe', ids, user=user)
+                statuses.update(dict.fromkeys(recipes, BULK_MISSING))
+                statuses.update(dict.fromkeys(deleted, BULK_DELETED))
+                change_counters(Recipe, deleted, counter, -1)
+                if model is ShoppingCart:
+                    remove_recipes_from_shopping_list(user, deleted)
+        return get_bulk_response(ids, statuses)
+
 
-class RecipeViewSet(ModelViewSet, FavoriteShoppingCart):
+class RecipeViewSet(ServerTimingMixin, ModelViewSet, FavoriteShoppingCart):
     queryset = Recipe.objects.all()
     pagination_class = CustomPagination
     permission_classes = [IsAuthorOrReadOnly]
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, StableOrderingFilter]
     filterset_class = FilterForRecipes
+    ordering_fields = ('pub_date', 'cooking_time', 'favorites_count',
+                       'shopping_cart_count', 'trending_score')
+    # Популярные сначала, по индексу recipe_trending_idx
+    ordering_aliases = {'trending': '-trending_score'}
+
+    # Для чтения подгружаем автора, теги и ингредиенты заранее, чтобы
+    # число запросов не зависело от размера страницы. Флаги избранного,
+    # корзины и подписки берутся из контекста пользователя (api.viewer)
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ['list', 'retrieve', 'feed']:
+            return queryset
+        return queryset.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipes',
+                queryset=AmountIngredient.objects.select_related(
+                    'ingredient').order_by('id')
+            )
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.get_list_response(
+            self.filter_queryset(self.get_queryset())
+        )
+
+    def get_list_response(self, queryset):
+        if not settings.API_FAST_SERIALIZATION:
+            page = self.paginate_queryset(queryset)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        # Страница выбирается по строкам .values() и сериализуется
+        # без полей DRF, связанные данные загружаются отдельными запросами.
+        # Выбираются только столбцы сериализатора и ключи сортировки для
+        # курсора, без search_vector и других служебных столбцов
+        ordering = [
+            field.lstrip('-')
+            for field in queryset.query.order_by or Recipe._meta.ordering
+            if isinstance(field, str) and field.lstrip('-') != 'pk'
+        ]
+        queryset = queryset.select_related(None).prefetch_related(
+            None
+        ).values(*dict.fromkeys([*RECIPE_FIELDS, *ordering]))
+        page = self.paginate_queryset(queryset)
+        self.start_serializer_timing()
+        data = serialize_recipes(page, self.request)
+        return self.get_paginated_response(data)
+
+    # Новые рецепты авторов, на которых подписан пользователь.
+    # Поддерживает те же фильтры, сортировку и пагинацию, что и список
+    @action(detail=False, methods=['GET'],
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        return self.get_list_response(self.filter_queryset(
+            get_feed(request.user, self.get_queryset())
+        ))
+
+    # Рецепт пропадет из корзин, поэтому вычитаем его из списков покупок
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        remove_recipe_from_all_shopping_lists(instance)
+        instance.delete()
+        change_counter(User, instance.author_id, 'recipes_count', -1)
 
     # Определяем, какой сериализатор использовать в зависимости от действия
     def get_serializer_class(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'feed']:
             # Сериализатор для просмотра списка и конкретного рецепта
             return GetRecipeSerializer
         # Сериализатор для создания и изменения рецепта
@@ -176,6 +445,18 @@ class RecipeViewSet(ModelViewSet, FavoriteShoppingCart):
             return self.delete_method(ShoppingCart, pk, request, error_message)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    # Пакетные версии favorite и shopping_cart: {"ids": [...]} в теле
+    # запроса, в ответе результат для каждого id
+    @action(detail=False, methods=('POST', 'DELETE'), url_path='favorite',
+            permission_classes=[IsAuthenticated])
+    def favorite_bulk(self, request):
+        return self.bulk_method(Favorite, request)
+
+    @action(detail=False, methods=('POST', 'DELETE'),
+            url_path='shopping_cart', permission_classes=[IsAuthenticated])
+    def shopping_cart_bulk(self, request):
+        return self.bulk_method(ShoppingCart, request)
+
     # Добавляем действие "download_shopping_cart" для скачивания списка покупок
     @action(
         detail=False,
@@ -183,12 +464,83 @@ class RecipeViewSet(ModelViewSet, FavoriteShoppingCart):
         permission_classes=[IsAuthenticated]
     )
     def download_shopping_cart(self, request):
-        shopping_list_final = create_ingredient_list(request.user)
-        filename = 'shopping_list.txt'
-        response = HttpResponse(
-            shopping_list_final,
-            content_type='text/plain',
+        # Формат файла выбирается параметром type: txt, csv или json
+        file_format = request.query_params.get('type', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            raise exceptions.ValidationError(
+                {'type': 'Допустимые форматы: '
+                         + ', '.join(SHOPPING_LIST_FORMATS)})
+        content_type, extension, _ = SHOPPING_LIST_FORMATS[file_format]
+        filename = f'shopping_list.{extension}'
+        response = StreamingHttpResponse(
+            create_ingredient_list(request.user, file_format),
+            content_type=content_type,
         )
         response['Content-Disposition'] = ('attachment; filename={0}'
                                            .format(filename))
         return response
+
+    # Изображение рецепта заданного размера (size) и формата (type).
+    # Готовые производные изображения отдаются с диска, остальные
+    # создаются при первом запросе и хранятся в ограниченном кэше
+    @action(detail=True, methods=['GET'], permission_classes=[AllowAny])
+    def image(self, request, pk=None):
+        size = request.query_params.get('size', 'card')
+        if size not in IMAGE_SIZES:
+            raise exceptions.ValidationError(
+                {'size': 'Допустимые размеры: ' + ', '.join(IMAGE_SIZES)})
+        extension = request.query_params.get('type')
+        if extension is None:
+            accept = request.META.get('HTTP_ACCEPT', '')
+            extension = 'webp' if 'image/webp' in accept else 'jpeg'
+        if extension not in IMAGE_FORMATS:
+            raise exceptions.ValidationError(
+                {'type': 'Допустимые форматы: ' + ', '.join(IMAGE_FORMATS)})
+        recipe = self.get_object()
+        content_type = IMAGE_CONTENT_TYPES[extension]
+
+        variant = recipe.image_variants.get(size, {}).get(extension)
+        content = None
+        # Строка рецепта может ссылаться на удаленный или поврежденный
+        # файл: это устаревшие данные, а не ошибка сервера
+        try:
+            if variant:
+                response = send_file(
+                    default_storage.path(variant),
+                    default_storage.url(variant),
+                    content_type,
+                )
+            else:
+                relative_path = image_cache.get_relative_path(
+                    recipe.image.name, size, extension
+                )
+                path = image_cache.get(relative_path)
+                if path is None:
+                    content = render_variant(
+                        recipe.image.name, size, extension
+                    )
+                else:
+                    response = send_file(
+                        path,
+                        settings.IMAGE_CACHE_URL + relative_path,
+                        content_type,
+                    )
+        except (OSError, UnidentifiedImageError):
+            raise exceptions.NotFound('Изображение рецепта недоступно')
+        if content is not None:
+            image_cache.put(relative_path, content)
+            response = HttpResponse(content, content_type=content_type)
+        patch_cache_control(
+            response, public=True, max_age=settings.IMAGE_MAX_AGE
+        )
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+# Скользящая статистика запросов по представлениям (api.middleware),
+# объединенная по всем воркерам через общий кэш
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(endpoint_metrics.get_snapshot())
@@ -0,0 +1,44 @@
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Ниже этого числа строк оценка статистики PostgreSQL ненадежна,
+# и считается точное значение
+ESTIMATE_FROM = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    '''Пагинатор админки с приблизительным числом строк.
+
+    COUNT(*) по таблице с миллионами строк в PostgreSQL читает ее
+    целиком. Для списка без фильтров число строк берется из статистики
+    планировщика (pg_class.reltuples), для отфильтрованного и в других
+    СУБД считается как обычно.
+    '''
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        query = queryset.query
+        if (connection.vendor == 'postgresql' and not query.where
+                and not query.distinct):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [connection.ops.quote_name(queryset.model._meta.db_table)],
+                )
+                row = cursor.fetchone()
+            if row is not None and row[0] >= ESTIMATE_FROM:
+                return int(row[0])
+        return super().count
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    # Список не считает строки таблицы повторно и берет их число
+    # из статистики, связанные объекты строк загружаются в том же
+    # запросе, а выбор связанных объектов — поиском вместо <select>
+    # со всеми строками
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
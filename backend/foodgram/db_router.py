@@ -0,0 +1,44 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Чтение с реплик включается только на время безопасных запросов API
+# (api.middleware.ReplicaRoutingMiddleware). Команды, админка, фоновые
+# потоки и запросы, меняющие данные, работают с основной базой
+_use_replicas = ContextVar('use_replicas', default=False)
+
+
+@contextmanager
+def use_replicas(enabled=True):
+    token = _use_replicas.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replicas.reset(token)
+
+
+class ReplicaRouter:
+    '''Направляет чтение на реплики из DATABASE_REPLICAS, запись —
+    в основную базу.'''
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or not _use_replicas.get():
+            return DEFAULT_DB_ALIAS
+        # Внутри транзакции чтение должно видеть ее изменения
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит с основной базы
+        return db not in settings.DATABASE_REPLICAS
@@ -39,6 +39,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы учитывать время всех остальных обработчиков
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +87,41 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения, через запятую: host или host:port для PostgreSQL,
+# пути к файлам для SQLite. Безопасные запросы API читают с них
+# (foodgram.db_router, api.middleware.ReplicaRoutingMiddleware)
+DATABASE_REPLICAS = []
+for number, address in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', default='').split(',')), start=1
+):
+    replica = {
+        **DATABASES['default'],
+        # В тестах реплики читают тестовую основную базу
+        'TEST': {'MIRROR': 'default'},
+    }
+    if replica['ENGINE'].endswith('sqlite3'):
+        replica['NAME'] = address
+    else:
+        host, _, port = address.partition(':')
+        replica.update(HOST=host, PORT=port or replica['PORT'])
+    DATABASES[f'replica{number}'] = replica
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['foodgram.db_router.ReplicaRouter']
+# Сколько секунд после записи клиент читает из основной базы
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', default=5))
+
+CACHES = {
+    'default': {
+        # Кэш по умолчанию общий для всех воркеров gunicorn в контейнере
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='/tmp/foodgram-cache'),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -124,6 +162,18 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Количество фоновых потоков обработки изображений рецептов
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+# Дисковый кэш уменьшенных изображений и его предельный размер в байтах
+IMAGE_CACHE_ROOT = os.path.join(MEDIA_ROOT, 'image_cache')
+IMAGE_CACHE_URL = MEDIA_URL + 'image_cache/'
+IMAGE_CACHE_MAX_BYTES = int(
+    os.getenv('IMAGE_CACHE_MAX_BYTES', default=256 * 1024 * 1024)
+)
+# max-age для ответов с изображениями, секунды
+IMAGE_MAX_AGE = 60 * 60
+# Отдавать файлы через nginx заголовком X-Accel-Redirect
+USE_X_ACCEL_REDIRECT = os.getenv('USE_X_ACCEL_REDIRECT') == 'True'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -140,8 +190,13 @@ REST_FRAMEWORK = {
     ],
     # Классы аутентификации по умолчанию для DRF
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-    ]
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    # JSON кодируется orjson, если он установлен
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 DJOSER = {
@@ -163,6 +218,35 @@ DJOSER = {
 }
 
 PAGE_SIZE = 6
+# Списки рецептов, тегов и ингредиентов сериализуются без полей DRF
+# (см. api.fast_serializers)
+API_FAST_SERIALIZATION = os.getenv('API_FAST_SERIALIZATION') == 'True'
+
+# Время жизни версий таблиц справочников в кэше, секунды
+TABLE_VERSION_TIMEOUT = 60 * 60 * 24
+# max-age для ответов справочников (теги, ингредиенты), секунды
+REFERENCE_CACHE_MAX_AGE = 60
+
+# Время хранения токена с пользователем в кэше аутентификации, секунды
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 60))
+# Запросы к БД дольше этого порога пишутся в лог, миллисекунды
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 100))
+# Сколько последних запросов каждого представления учитывать в метриках
+METRICS_WINDOW = 1000
+# Как часто воркер публикует свои метрики в общий кэш и сколько они
+# там хранятся без обновления, секунды
+METRICS_PUBLISH_INTERVAL = 5
+METRICS_TIMEOUT = 15 * 60
+# Период полураспада популярности рецептов (см. recipes.trending), часы
+TRENDING_HALF_LIFE_HOURS = int(os.getenv('TRENDING_HALF_LIFE_HOURS', 48))
+# Наибольшее число id в пакетных действиях с избранным, корзиной
+# и подписками
+BULK_MAX_IDS = 100
+# Рецепты авторов, у которых подписчиков больше этого числа, не пишутся
+# в ленты подписчиков, а выбираются при чтении ленты (см. recipes.feed)
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+# Сколько последних рецептов хранить в ленте пользователя
+FEED_MAX_LENGTH = int(os.getenv('FEED_MAX_LENGTH', 500))
 
 CSRF_TRUSTED_ORIGINS = [
     'https://yc-foodgram.ddns.net',
@@ -1,13 +1,19 @@
 from django.contrib import admin
 
+from foodgram.admin_utils import ScalableAdmin
 from .models import (Favorite, Ingredient, Recipe,
                      ShoppingCart, Tag, AmountIngredient)
+from .search import search_recipes
 
 
 class AmountIngredientInline(admin.TabularInline):
     model = AmountIngredient
     extra = 1
     min_num = 1
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
 
 
 @admin.register(Ingredient)
@@ -31,32 +37,55 @@ class TagAdmin(admin.ModelAdmin):
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(ScalableAdmin):
     list_display = (
         'id',
         'author',
         'name',
         'text',
         'cooking_time',
+        'favorites_count',
+        'shopping_cart_count',
+        'pub_date',
     )
-    list_filter = ('author__email', 'tags', 'name')
-    search_fields = ('author__email', 'name',)
+    list_select_related = ('author',)
+    # Варианты фильтров не зависят от числа рецептов: теги и периоды
+    # дат, автор и название ищутся. date_hierarchy не используется,
+    # его годы и месяцы выбираются по всей таблице
+    list_filter = ('tags', 'pub_date')
+    search_fields = ('name',)
+    search_help_text = ('Полнотекстовый поиск по названию, описанию и '
+                        'ингредиентам или точный email автора')
+    autocomplete_fields = ('author',)
+    # Счетчики поддерживаются API (recipes.counters), правка вручную
+    # разошлась бы со связями
+    readonly_fields = ('favorites_count', 'shopping_cart_count')
     inlines = [AmountIngredientInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if '@' in search_term:
+            return queryset.filter(author__email=search_term), False
+        return search_recipes(queryset, search_term), False
 
-@admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+
+class UserRecipeAdmin(ScalableAdmin):
     list_display = (
         'id',
         'user',
         'recipe'
     )
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+
+
+@admin.register(ShoppingCart)
+class ShoppingCartAdmin(UserRecipeAdmin):
+    pass
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
-    list_display = (
-        'id',
-        'user',
-        'recipe'
-    )
+class FavoriteAdmin(UserRecipeAdmin):
+    pass
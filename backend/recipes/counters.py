@@ -0,0 +1,64 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import Follow
+from .models import Favorite, Recipe, ShoppingCart
+
+User = get_user_model()
+
+# Денормализованные счетчики: (модель, поле счетчика, модель связи,
+# внешний ключ связи на модель счетчика)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'followers_count', Follow, 'author'),
+    (User, 'recipes_count', Recipe, 'author'),
+)
+BATCH_SIZE = 500
+# Поле счетчика рецепта для избранного и корзины
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'shopping_cart_count',
+}
+
+
+def change_counter(model, pk, field, delta):
+    '''Атомарно изменяет счетчик одним UPDATE, не опускаясь ниже нуля.'''
+    change_counters(model, [pk], field, delta)
+
+
+def change_counters(model, pks, field, delta):
+    '''То же для нескольких объектов сразу.'''
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, Value(0))}
+    )
+
+
+def count_related(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def reconcile_counters(fix=True):
+    '''Сверяет счетчики с COUNT по связям и исправляет расхождения.
+
+    Возвращает {(модель, поле): id объектов с расхождением}.
+    '''
+    drift = {}
+    for model, field, related_model, related_field in COUNTERS:
+        wrong_ids = list(
+            model.objects.annotate(
+                actual=count_related(related_model, related_field)
+            ).exclude(**{field: F('actual')}).values_list('pk', flat=True)
+        )
+        drift[model._meta.label, field] = wrong_ids
+        if not fix:
+            continue
+        for start in range(0, len(wrong_ids), BATCH_SIZE):
+            model.objects.filter(
+                pk__in=wrong_ids[start:start + BATCH_SIZE]
+            ).update(**{field: count_related(related_model, related_field)})
+    return drift
@@ -0,0 +1,217 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from users.models import Follow
+from .models import FeedEntry, Recipe
+
+User = get_user_model()
+
+# Лента подписок строится по записи (fan-out-on-write): при публикации
+# рецепт добавляется в FeedEntry каждого подписчика автора, и чтение
+# ленты не зависит от числа подписок и рецептов. Для авторов, у которых
+# подписчиков больше FEED_FANOUT_LIMIT, запись стоила бы слишком дорого,
+# их рецепты выбираются при чтении (fan-out-on-read) по индексу автора.
+# Режим хранится в User.feed_fanout_on_read, а не вычисляется по
+# текущему числу подписчиков: рецепты, опубликованные в режиме чтения,
+# есть только в нем. Обратно к записи автора возвращает resume_fanout
+# (команда trim_feeds), дописывая его рецепты в ленты подписчиков.
+# Длина лент ограничивается FEED_MAX_LENGTH командой trim_feeds.
+BATCH_SIZE = 1000
+# К записи возвращаются авторы, у которых подписчиков заметно меньше
+# лимита, чтобы автор около лимита не переключался туда и обратно
+RESUME_RATIO = 0.8
+
+
+def get_fanout_limit(limit=None):
+    return settings.FEED_FANOUT_LIMIT if limit is None else limit
+
+
+def fan_out_recipe(recipe, limit=None):
+    '''Добавляет рецепт в ленты подписчиков автора.
+
+    Возвращает число созданных записей: ноль, если рецепты автора
+    выбираются при чтении. Автор, у которого стало больше limit
+    подписчиков, переводится в этот режим.
+    '''
+    author = recipe.author
+    if (not author.feed_fanout_on_read
+            and author.followers_count > get_fanout_limit(limit)):
+        User.objects.filter(id=author.id).update(feed_fanout_on_read=True)
+        author.feed_fanout_on_read = True
+    if author.feed_fanout_on_read:
+        return 0
+    follower_ids = Follow.objects.filter(
+        author_id=recipe.author_id
+    ).values_list('user_id', flat=True)
+    entries = FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe.id,
+                author_id=recipe.author_id,
+                pub_date=recipe.pub_date,
+            )
+            for user_id in follower_ids.iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    return len(entries)
+
+
+def add_authors_to_feed(user, author_ids):
+    '''Переносит в ленту новых подписок последние рецепты авторов.'''
+    recipes = Recipe.objects.filter(
+        author_id__in=author_ids,
+        author__feed_fanout_on_read=False,
+    ).order_by('-pub_date', '-id').values_list(
+        'id', 'author_id', 'pub_date'
+    )[:settings.FEED_MAX_LENGTH]
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user=user,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for recipe_id, author_id, pub_date in recipes
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def remove_authors_from_feed(user, author_ids):
+    FeedEntry.objects.filter(user=user, author_id__in=author_ids).delete()
+
+
+def get_feed(user, queryset=None):
+    '''Рецепты ленты подписок пользователя в порядке публикации.'''
+    if queryset is None:
+        queryset = Recipe.objects.all()
+    popular_authors = list(User.objects.filter(
+        followings__user=user,
+        feed_fanout_on_read=True,
+    ).values_list('id', flat=True))
+    if popular_authors:
+        # Записи ленты объединяются с рецептами авторов, которые
+        # не пишутся в ленты, и сортируются (не больше FEED_MAX_LENGTH
+        # записей и рецепты нескольких авторов)
+        return queryset.filter(
+            Q(id__in=FeedEntry.objects.filter(user=user).values('recipe_id'))
+            | Q(author_id__in=popular_authors)
+        )
+    # Иначе страница читается прямо по индексу ленты без сортировки
+    return queryset.filter(feed_entries__user=user).annotate(
+        feed_pub_date=F('feed_entries__pub_date'),
+        feed_recipe_id=F('feed_entries__recipe_id'),
+    ).order_by('-feed_pub_date', '-feed_recipe_id')
+
+
+def trim_feeds(max_length=None):
+    '''Удаляет из лент записи старше max_length последних.'''
+    if max_length is None:
+        max_length = settings.FEED_MAX_LENGTH
+    ranked = FeedEntry.objects.annotate(position=Window(
+        RowNumber(),
+        partition_by=F('user_id'),
+        order_by=[F('pub_date').desc(), F('recipe_id').desc()],
+    )).filter(position__gt=max_length)
+    deleted, _ = FeedEntry.objects.filter(
+        pk__in=ranked.values('pk')
+    ).delete()
+    return deleted
+
+
+def resume_fanout(limit=None):
+    '''Возвращает к записи в ленты авторов, у которых подписчиков стало
+    меньше RESUME_RATIO от limit. Возвращает число таких авторов.'''
+    authors = User.objects.filter(
+        feed_fanout_on_read=True,
+        followers_count__lte=get_fanout_limit(limit) * RESUME_RATIO,
+    )
+    resumed = 0
+    for author_id in list(authors.values_list('id', flat=True)):
+        with transaction.atomic():
+            # UPDATE блокирует строку автора до конца транзакции. Публикация
+            # и подписка тоже обновляют ее счетчики до чтения режима,
+            # поэтому либо ждут и уже пишут в ленты сами, либо завершаются
+            # раньше, и их рецепт и подписка видны ниже
+            if not authors.filter(id=author_id).update(
+                feed_fanout_on_read=False
+            ):
+                continue
+            recipes = list(Recipe.objects.filter(
+                author_id=author_id
+            ).order_by('-pub_date', '-id').values_list(
+                'id', 'pub_date'
+            )[:settings.FEED_MAX_LENGTH])
+            follower_ids = Follow.objects.filter(
+                author_id=author_id
+            ).values_list('user_id', flat=True)
+            FeedEntry.objects.bulk_create(
+                (
+                    FeedEntry(
+                        user_id=user_id,
+                        recipe_id=recipe_id,
+                        author_id=author_id,
+                        pub_date=pub_date,
+                    )
+                    for user_id in follower_ids.iterator()
+                    for recipe_id, pub_date in recipes
+                ),
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+        resumed += 1
+    return resumed
+
+
+def rebuild_feeds(user_ids=None, limit=None):
+    '''Заполняет ленты заново по текущим подпискам.
+
+    Нужна после массовых вставок подписок и рецептов в обход API
+    и после изменения FEED_FANOUT_LIMIT. Полная перестройка заново
+    выбирает режим авторов по limit, перестройка лент user_ids
+    сохраняет текущий.
+    '''
+    entries = FeedEntry.objects.all()
+    if user_ids is None:
+        fanout_limit = get_fanout_limit(limit)
+        User.objects.filter(followers_count__gt=fanout_limit).update(
+            feed_fanout_on_read=True
+        )
+        User.objects.filter(followers_count__lte=fanout_limit).update(
+            feed_fanout_on_read=False
+        )
+    follows = Follow.objects.filter(author__feed_fanout_on_read=False)
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        follows = follows.filter(user_id__in=user_ids)
+    entries.delete()
+    authors_by_user = {}
+    for user_id, author_id in follows.values_list('user_id', 'author_id'):
+        authors_by_user.setdefault(user_id, []).append(author_id)
+    created = 0
+    for user_id, author_ids in authors_by_user.items():
+        recipes = Recipe.objects.filter(author_id__in=author_ids).order_by(
+            '-pub_date', '-id'
+        ).values_list('id', 'author_id', 'pub_date')
+        created += len(FeedEntry.objects.bulk_create(
+            (
+                FeedEntry(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+                for recipe_id, author_id, pub_date
+                in recipes[:settings.FEED_MAX_LENGTH]
+            ),
+            batch_size=BATCH_SIZE,
+        ))
+    return created
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+from .images import get_image_key
+
+# Доля лимита, после записи которой процесс заново считает размер
+# каталога. В каталог пишут все воркеры, и оценка только по своим
+# записям позволила бы кэшу вырасти до числа воркеров, умноженного на
+# лимит; так превышение не больше этой доли на воркер
+RESCAN_FRACTION = 0.05
+
+
+class ImageCache:
+    '''Дисковый кэш изображений с ограничением размера и вытеснением LRU.
+
+    Время последнего использования файла хранится в его mtime: при
+    попадании в кэш оно обновляется, а при переполнении удаляются
+    файлы с самым старым mtime. Общий размер берется из последнего
+    сканирования каталога плюс записи процесса после него; каталог
+    сканируется заново после записи RESCAN_FRACTION лимита и перед
+    вытеснением.
+    '''
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self._written = 0
+
+    def get_relative_path(self, image_name, size, extension):
+        return f'{get_image_key(image_name)}/{size}.{extension}'
+
+    def get(self, relative_path):
+        '''Возвращает путь к файлу кэша или None, если файла нет.'''
+        path = self.root / relative_path
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, relative_path, content):
+        path = self.root / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Пишем во временный файл и атомарно переименовываем, чтобы
+        # параллельный запрос не прочитал недописанный файл
+        descriptor, temp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._written += len(content)
+            if (self._size is None or self._written
+                    > self.max_bytes * RESCAN_FRACTION):
+                self._size = self.get_total_size()
+                self._written = 0
+            if self._size + self._written > self.max_bytes:
+                self.evict()
+        return path
+
+    def iter_files(self):
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = Path(directory) / name
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                yield path, stat
+
+    def get_total_size(self):
+        return sum(stat.st_size for _, stat in self.iter_files())
+
+    def evict(self):
+        # Освобождаем место с запасом, чтобы не сканировать каталог
+        # при каждой следующей записи
+        files = sorted(self.iter_files(), key=lambda item: item[1].st_mtime)
+        total = sum(stat.st_size for _, stat in files)
+        target = self.max_bytes * 0.9
+        for path, stat in files:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= stat.st_size
+        self._size = total
+        self._written = 0
+
+
+image_cache = ImageCache(
+    settings.IMAGE_CACHE_ROOT, settings.IMAGE_CACHE_MAX_BYTES
+)
@@ -0,0 +1,124 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Производные размеры изображения рецепта: наибольшая сторона в пикселях
+IMAGE_SIZES = {
+    'thumbnail': 240,
+    'card': 480,
+    'full': 1200,
+}
+# Форматы производных изображений: (формат Pillow, параметры сохранения)
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+IMAGE_CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+DERIVED_DIR = 'recipes/derived'
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS, thread_name_prefix='recipe-images'
+)
+
+
+def get_image_key(image_name):
+    # Ключ производных изображений оригинала. Одного имени без
+    # расширения мало: старые загрузки photo.jpg и photo.png получили бы
+    # общие производные, поэтому к нему добавляется хэш полного имени.
+    # Имя оригинала уже содержит хэш содержимого, поэтому производные
+    # изображения одинаковых загрузок по-прежнему общие
+    digest = hashlib.sha256(image_name.encode()).hexdigest()[:12]
+    return f'{PurePosixPath(image_name).stem}-{digest}'
+
+
+def get_variant_name(image_name, size, extension):
+    return f'{DERIVED_DIR}/{get_image_key(image_name)}/{size}.{extension}'
+
+
+def resize_image(image, max_side, image_format, options):
+    '''Уменьшает изображение до max_side и возвращает байты в формате.'''
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        # JPEG не поддерживает прозрачность: кладем на белый фон
+        background = Image.new('RGB', image.size, 'white')
+        image = image.convert('RGBA')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def open_image(image_name):
+    with default_storage.open(image_name, 'rb') as file:
+        image = Image.open(file)
+        image.load()
+    return image
+
+
+def render_variant(image_name, size, extension):
+    '''Возвращает байты изображения заданного размера и формата.'''
+    image_format, options = IMAGE_FORMATS[extension]
+    return resize_image(
+        open_image(image_name), IMAGE_SIZES[size], image_format, options
+    )
+
+
+def generate_variants(image_name):
+    '''Создает недостающие производные изображения и возвращает их имена.
+
+    Результат имеет вид {размер: {расширение: имя файла}}.
+    '''
+    variants = {}
+    original = open_image(image_name)
+    for size, max_side in IMAGE_SIZES.items():
+        variants[size] = {}
+        for extension, (image_format, options) in IMAGE_FORMATS.items():
+            name = get_variant_name(image_name, size, extension)
+            if not default_storage.exists(name):
+                content = resize_image(
+                    original.copy(), max_side, image_format, options
+                )
+                name = default_storage.save(name, ContentFile(content))
+            variants[size][extension] = name
+    return variants
+
+
+def process_recipe_image(image_name):
+    '''Создает производные изображения и сохраняет их у рецептов.'''
+    from .models import Recipe
+
+    variants = generate_variants(image_name)
+    Recipe.objects.filter(image=image_name).update(image_variants=variants)
+    return variants
+
+
+def _process_in_background(image_name):
+    try:
+        process_recipe_image(image_name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', image_name)
+    finally:
+        # Соединения потока пула не закрываются обработчиком запросов
+        connections.close_all()
+
+
+def schedule_recipe_image(image_name):
+    '''Ставит обработку изображения в фоновый пул после коммита.'''
+    transaction.on_commit(
+        lambda: _executor.submit(_process_in_background, image_name)
+    )
@@ -0,0 +1,83 @@
+import bisect
+import threading
+
+from .models import Ingredient
+from .versions import get_table_version
+
+# Ранги результатов: точное совпадение, префикс названия, префикс слова
+EXACT, PREFIX, WORD_PREFIX = range(3)
+
+
+def normalize(value):
+    '''Приводит строку к виду для сравнения без учета регистра.
+
+    str.casefold корректно работает с кириллицей (в отличие от LIKE
+    в SQLite), а "ё" приравнивается к "е", как это делают пользователи.
+    '''
+    return value.casefold().replace('ё', 'е')
+
+
+class IngredientPrefixIndex:
+    '''Отсортированный индекс ингредиентов в памяти процесса.
+
+    Для каждого ингредиента хранится ключ полного названия и ключи
+    каждого следующего слова в нём. Поиск по префиксу сводится к двум
+    бинарным поискам по отсортированному списку ключей.
+    Индекс строится лениво и перестраивается, когда меняется версия
+    таблицы ингредиентов (см. recipes.versions), в том числе после
+    записи в другом процессе.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+
+    def build(self):
+        entries = []
+        for pk, name, unit in Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit'
+        ).iterator():
+            item = {'id': pk, 'name': name, 'measurement_unit': unit}
+            key = normalize(name)
+            entries.append((key, False, key, pk, item))
+            words = key.split()
+            for position in range(1, len(words)):
+                word_key = ' '.join(words[position:])
+                entries.append((word_key, True, key, pk, item))
+        entries.sort(key=lambda entry: entry[:4])
+        keys = [entry[0] for entry in entries]
+        return keys, entries
+
+    def get_data(self):
+        version, _ = get_table_version(Ingredient)
+        data = self._data
+        if data is None or data[0] != version:
+            with self._lock:
+                data = self._data
+                if data is None or data[0] != version:
+                    data = self._data = (version, *self.build())
+        return data
+
+    def search(self, query, limit=None):
+        _, keys, entries = self.get_data()
+        key = normalize(query.strip())
+        start = bisect.bisect_left(keys, key)
+        end = bisect.bisect_left(keys, key + '\U0010ffff', lo=start)
+        ranked = {}
+        for entry_key, is_word, name_key, pk, item in entries[start:end]:
+            if is_word:
+                rank = WORD_PREFIX
+            elif entry_key == key:
+                rank = EXACT
+            else:
+                rank = PREFIX
+            if pk not in ranked or rank < ranked[pk][0]:
+                ranked[pk] = (rank, name_key, pk, item)
+        results = [match[3] for match in sorted(ranked.values(),
+                                                key=lambda m: m[:3])]
+        if limit is not None:
+            results = results[:limit]
+        return results
+
+
+ingredient_index = IngredientPrefixIndex()
@@ -0,0 +1,424 @@
+import base64
+import io
+import json
+import math
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
+from users.models import Follow
+from .seed_data import SEED_DOMAIN
+
+User = get_user_model()
+
+BENCHMARK_EMAIL = 'benchmark{}@' + SEED_DOMAIN
+
+
+class Step:
+    '''Запрос сценария. Путь и тело подставляются из состояния прогона.'''
+
+    def __init__(self, method, path, data=None, auth='reader', status=200,
+                 save=None):
+        self.method = method
+        self.path = path
+        self.data = data
+        self.auth = auth
+        self.status = status
+        # (ключ состояния, ключ ответа) для значений из ответа
+        self.save = save
+        self.name = f'{method} {path}'
+
+
+class ClientTransport:
+    '''Запросы тестовым клиентом Django в том же процессе.'''
+
+    counts_queries = True
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, body, token):
+        extra = {}
+        if token:
+            extra['HTTP_AUTHORIZATION'] = f'Token {token}'
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = self.client.generic(
+                method, path, body or '', 'application/json', **extra
+            )
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+                response.close()
+            else:
+                content = response.content
+            elapsed = time.perf_counter() - start
+        return response.status_code, content, elapsed, len(queries)
+
+
+class HTTPTransport:
+    '''Запросы по HTTP к запущенному серверу. Запросы к БД не считаются.'''
+
+    counts_queries = False
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body, token):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        request = Request(
+            self.base_url + path,
+            data=body.encode() if body else None,
+            headers=headers,
+            method=method,
+        )
+        start = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                status, content = response.status, response.read()
+        except HTTPError as error:
+            status, content = error.code, error.read()
+        return status, content, time.perf_counter() - start, None
+
+
+def percentile(values, percent):
+    # Метод ближайшего ранга: значения уже отсортированы
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def get_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (200, 120, 40)).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет все маршруты API и выводит число запросов к БД, '
+            'p50/p95/p99 задержки и пропускную способность в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--user', help='Email пользователя для запросов, '
+                                           'по умолчанию первый из seed_data')
+        parser.add_argument('--password', default='seed-password',
+                            help='Пароль второго пользователя для входа')
+        parser.add_argument('--base-url',
+                            help='Адрес запущенного сервера; по умолчанию '
+                                 'тестовый клиент в этом процессе')
+        parser.add_argument('--output', help='Файл для JSON-отчета')
+
+    def get_users(self, email):
+        users = User.objects.filter(email__endswith='@' + SEED_DOMAIN)
+        if email is not None:
+            reader = User.objects.filter(email=email).first()
+        else:
+            reader = users.exclude(
+                email__startswith='benchmark'
+            ).order_by('id').first()
+        if reader is None:
+            raise CommandError('Нет пользователя для запросов, сначала '
+                               'выполните seed_data')
+        other = users.exclude(id=reader.id).exclude(
+            email__startswith='benchmark'
+        ).order_by('id').first()
+        if other is None:
+            raise CommandError('Нужен второй пользователь из seed_data')
+        return reader, other
+
+    def get_state(self, reader, other, password):
+        recipe = Recipe.objects.order_by('id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        tag = Tag.objects.order_by('id').first()
+        if recipe is None or ingredient is None or tag is None:
+            raise CommandError('Нет данных, сначала выполните seed_data')
+        # Для переключаемых действий берем объекты, которых у
+        # пользователя еще нет: каждая итерация добавляет и удаляет их
+        favorite = Recipe.objects.exclude(
+            id__in=Favorite.objects.filter(user=reader).values('recipe_id')
+        ).order_by('id').first()
+        cart = Recipe.objects.exclude(
+            id__in=ShoppingCart.objects.filter(
+                user=reader).values('recipe_id')
+        ).order_by('id').first()
+        author = User.objects.exclude(id=reader.id).exclude(
+            id__in=Follow.objects.filter(user=reader).values('author_id')
+        ).order_by('id').first()
+        if favorite is None or cart is None or author is None:
+            raise CommandError('У пользователя уже есть все рецепты '
+                               'в избранном, корзине или все подписки')
+        # Сотрудник для запросов к метрикам, удаляется вместе с
+        # зарегистрированными во время прогона пользователями
+        staff = User.objects.create_user(
+            email=BENCHMARK_EMAIL.format('staff'),
+            username='benchmark-staff',
+            first_name='Сотрудник',
+            last_name='Тестовый',
+            is_staff=True,
+        )
+        return {
+            'reader': Token.objects.get_or_create(user=reader)[0].key,
+            'staff': Token.objects.create(user=staff).key,
+            'reader_id': reader.id,
+            'other_email': other.email,
+            'password': password,
+            'recipe': recipe.id,
+            'ingredient': ingredient.id,
+            'ingredients': list(
+                Ingredient.objects.order_by('id')
+                .values_list('id', flat=True)[:5]
+            ),
+            'tag': tag.id,
+            'tag_slug': tag.slug,
+            # Слово из названия, чтобы поиск находил рецепты
+            'search': quote(recipe.name.split()[0]),
+            'favorite': favorite.id,
+            'cart': cart.id,
+            'author': author.id,
+            'image': get_image(),
+        }
+
+    def get_steps(self):
+        def new_recipe(state):
+            return {
+                'name': 'Рецепт для нагрузочного теста',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'image': state['image'],
+                'tags': [state['tag']],
+                'ingredients': [
+                    {'id': pk, 'amount': 10} for pk in state['ingredients']
+                ],
+            }
+
+        def new_user(state):
+            return {
+                'email': BENCHMARK_EMAIL.format(state['iteration']),
+                'username': f'benchmark{state["iteration"]}',
+                'first_name': 'Имя',
+                'last_name': 'Фамилия',
+                'password': 'benchmark-Password-1',
+            }
+
+        def bulk(key):
+            return lambda state: {'ids': [state[key]]}
+
+        return [
+            Step('GET', '/api/', auth=None),
+            # Метрики доступны только персоналу
+            Step('GET', '/api/metrics/', auth='staff'),
+            Step('GET', '/api/tags/', auth=None),
+            Step('GET', '/api/tags/{tag}/', auth=None),
+            Step('GET', '/api/ingredients/', auth=None),
+            Step('GET', '/api/ingredients/?name=мо', auth=None),
+            Step('GET', '/api/ingredients/{ingredient}/', auth=None),
+            Step('GET', '/api/recipes/', auth=None),
+            Step('GET', '/api/recipes/'),
+            Step('GET', '/api/recipes/?page=2'),
+            Step('GET', '/api/recipes/?cursor='),
+            Step('GET', '/api/recipes/?tags={tag_slug}'),
+            Step('GET', '/api/recipes/?author={reader_id}'),
+            Step('GET', '/api/recipes/?is_favorited=1'),
+            Step('GET', '/api/recipes/?is_in_shopping_cart=1'),
+            Step('GET', '/api/recipes/?search={search}'),
+            Step('GET', '/api/recipes/?ordering=trending'),
+            Step('GET', '/api/recipes/feed/'),
+            Step('GET', '/api/recipes/{recipe}/'),
+            Step('GET', '/api/recipes/{recipe}/image/?size=card&type=webp',
+                 auth=None),
+            Step('GET', '/api/recipes/download_shopping_cart/'),
+            Step('GET', '/api/recipes/download_shopping_cart/?type=csv'),
+            Step('GET', '/api/recipes/download_shopping_cart/?type=json'),
+            Step('POST', '/api/recipes/', new_recipe, status=201,
+                 save=('new_recipe', 'id')),
+            Step('PATCH', '/api/recipes/{new_recipe}/',
+                 lambda state: {'cooking_time': 20}),
+            Step('DELETE', '/api/recipes/{new_recipe}/', status=204),
+            Step('POST', '/api/recipes/{favorite}/favorite/', status=201),
+            Step('DELETE', '/api/recipes/{favorite}/favorite/', status=204),
+            Step('POST', '/api/recipes/{cart}/shopping_cart/', status=201),
+            Step('DELETE', '/api/recipes/{cart}/shopping_cart/', status=204),
+            # Пакетные запросы отвечают 200 со статусом каждого id
+            Step('POST', '/api/recipes/favorite/', bulk('favorite')),
+            Step('DELETE', '/api/recipes/favorite/', bulk('favorite')),
+            Step('POST', '/api/recipes/shopping_cart/', bulk('cart')),
+            Step('DELETE', '/api/recipes/shopping_cart/', bulk('cart')),
+            Step('GET', '/api/users/'),
+            Step('GET', '/api/users/me/'),
+            Step('GET', '/api/users/{author}/'),
+            Step('GET', '/api/users/subscriptions/'),
+            Step('GET', '/api/users/subscriptions/?recipes_limit=3'),
+            Step('POST', '/api/users/{author}/subscribe/', status=201),
+            Step('DELETE', '/api/users/{author}/subscribe/', status=204),
+            Step('POST', '/api/users/subscribe/', bulk('author')),
+            Step('DELETE', '/api/users/subscribe/', bulk('author')),
+            Step('POST', '/api/users/', new_user, auth=None, status=201),
+            Step('POST', '/api/auth/token/login/',
+                 lambda state: {'email': state['other_email'],
+                                'password': state['password']},
+                 auth=None, save=('login', 'auth_token')),
+            Step('POST', '/api/users/set_password/',
+                 lambda state: {'current_password': state['password'],
+                                'new_password': state['password']},
+                 auth='login', status=204),
+            Step('POST', '/api/auth/token/logout/', auth='login',
+                 status=204),
+        ]
+
+    def run_step(self, transport, step, state):
+        path = step.path.format(**state)
+        body = None
+        if step.data is not None:
+            body = json.dumps(step.data(state))
+        token = state.get(step.auth) if step.auth else None
+        status, content, elapsed, queries = transport.request(
+            step.method, path, body, token
+        )
+        if step.save is not None and status == step.status:
+            key, field = step.save
+            state[key] = json.loads(content)[field]
+        return status, elapsed, queries
+
+    def run(self, transport, steps, state, iterations, warmup):
+        results = {
+            step.name: {'times': [], 'queries': [], 'statuses': Counter()}
+            for step in steps
+        }
+        for iteration in range(warmup + iterations):
+            state['iteration'] = iteration
+            for step in steps:
+                status, elapsed, queries = self.run_step(
+                    transport, step, state
+                )
+                if iteration < warmup:
+                    continue
+                result = results[step.name]
+                result['times'].append(elapsed)
+                result['statuses'][status] += 1
+                if queries is not None:
+                    result['queries'].append(queries)
+        return results
+
+    def get_report(self, steps, results):
+        report = {}
+        for step in steps:
+            result = results[step.name]
+            times = sorted(result['times'])
+            queries = result['queries']
+            report[step.name] = {
+                'requests': len(times),
+                'expected_status': step.status,
+                'statuses': {
+                    str(status): count
+                    for status, count in sorted(result['statuses'].items())
+                },
+                'errors': sum(
+                    count for status, count in result['statuses'].items()
+                    if status != step.status
+                ),
+                'queries': max(queries) if queries else None,
+                'p50_ms': round(percentile(times, 50) * 1000, 3),
+                'p95_ms': round(percentile(times, 95) * 1000, 3),
+                'p99_ms': round(percentile(times, 99) * 1000, 3),
+                'mean_ms': round(statistics.fmean(times) * 1000, 3),
+                'rps': round(len(times) / max(sum(times), 1e-9), 1),
+            }
+        return report
+
+    def get_dataset(self):
+        return {
+            'users': User.objects.count(),
+            'recipes': Recipe.objects.count(),
+            'ingredients': Ingredient.objects.count(),
+            'tags': Tag.objects.count(),
+            'favorites': Favorite.objects.count(),
+            'shopping_carts': ShoppingCart.objects.count(),
+            'shopping_list_items': ShoppingListItem.objects.count(),
+            'follows': Follow.objects.count(),
+        }
+
+    def cleanup(self):
+        # Удаляем пользователей, зарегистрированных во время прогона
+        User.objects.filter(
+            email__startswith='benchmark', email__endswith='@' + SEED_DOMAIN
+        ).delete()
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('Нужна хотя бы одна итерация')
+        reader, other = self.get_users(options['user'])
+        self.cleanup()
+        state = self.get_state(reader, other, options['password'])
+        steps = self.get_steps()
+        if options['base_url']:
+            transport = HTTPTransport(options['base_url'])
+            results = self.run(transport, steps, state,
+                               options['iterations'], options['warmup'])
+        else:
+            transport = ClientTransport()
+            # Тестовый клиент обращается к хосту testserver
+            with override_settings(ALLOWED_HOSTS=['*']):
+                results = self.run(transport, steps, state,
+                                   options['iterations'], options['warmup'])
+        self.cleanup()
+
+        report = {
+            'meta': {
+                'created': datetime.now(timezone.utc).isoformat(),
+                'git_commit': get_git_commit(),
+                'database': connection.vendor,
+                'transport': options['base_url'] or 'django.test.Client',
+                'python': sys.version.split()[0],
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'dataset': self.get_dataset(),
+            },
+            'endpoints': self.get_report(steps, results),
+        }
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if not options['output']:
+            self.stdout.write(content)
+            return
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            file.write(content + '\n')
+        for name, endpoint in report['endpoints'].items():
+            self.stdout.write(
+                f'{name:<60} p50 {endpoint["p50_ms"]:8.2f} мс, '
+                f'p99 {endpoint["p99_ms"]:8.2f} мс, '
+                f'запросов к БД {endpoint["queries"]}, '
+                f'ошибок {endpoint["errors"]}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Отчет записан в {options["output"]}'
+        ))
@@ -0,0 +1,220 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.counters import reconcile_counters
+from recipes.feed import fan_out_recipe, get_feed, rebuild_feeds
+from recipes.models import Recipe
+from users.models import Follow
+from .seed_data import SEED_DOMAIN
+
+User = get_user_model()
+
+# Пользователи бенчмарка удаляются вместе с данными seed_data --clear
+AUTHOR_EMAIL = f'feed_author@{SEED_DOMAIN}'
+FOLLOWER_EMAIL = 'feed_follower{}@' + SEED_DOMAIN
+# Лимит, при котором любой автор пишется в ленты
+NO_LIMIT = 10 ** 9
+# Режимы ленты: (название, рецепты автора выбираются при чтении)
+MODES = (('запись', False), ('чтение', True))
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает ленту подписок по записи (fan-out-on-write), '
+            'по чтению (fan-out-on-read) и JOIN по подпискам для автора '
+            'с большим числом подписчиков')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Подписок каждого подписчика на других '
+                                 'авторов')
+        parser.add_argument('--author-recipes', type=int, default=200)
+        parser.add_argument('--publish', type=int, default=5,
+                            help='Сколько рецептов опубликовать')
+        parser.add_argument('--samples', type=int, default=20,
+                            help='Сколько подписчиков читают ленту')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def timed(self, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        return time.perf_counter() - start, result
+
+    def create_recipes(self, author, count, template, spread=False):
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                name=f'Рецепт для ленты №{number}',
+                text=template.text,
+                cooking_time=template.cooking_time,
+                image=template.image.name,
+            )
+            for number in range(count)
+        )
+        if spread:
+            # pub_date заполняется автоматически, распределяем даты
+            # прежних рецептов отдельно
+            today = date.today()
+            for recipe in recipes:
+                Recipe.objects.filter(id=recipe.id).update(
+                    pub_date=today - timedelta(days=self.rng.randrange(30))
+                )
+        return recipes
+
+    @transaction.atomic
+    def prepare(self, options, template):
+        author, created = User.objects.get_or_create(
+            email=AUTHOR_EMAIL,
+            defaults={
+                'username': 'feed_author',
+                'first_name': 'Автор',
+                'last_name': 'Ленты',
+            },
+        )
+        if created:
+            self.create_recipes(
+                author, options['author_recipes'], template, spread=True
+            )
+        existing = User.objects.filter(
+            email__startswith='feed_follower', email__endswith=SEED_DOMAIN
+        ).count()
+        password = make_password(None)
+        User.objects.bulk_create(
+            (
+                User(
+                    email=FOLLOWER_EMAIL.format(number),
+                    username=f'feed_follower{number}',
+                    first_name='Подписчик',
+                    last_name=str(number),
+                    password=password,
+                )
+                for number in range(existing, options['followers'])
+            ),
+            batch_size=1000,
+        )
+        follower_ids = list(User.objects.filter(
+            email__startswith='feed_follower', email__endswith=SEED_DOMAIN
+        ).order_by('id').values_list('id', flat=True))[:options['followers']]
+        other_authors = list(Recipe.objects.exclude(
+            author=author
+        ).values_list('author_id', flat=True).distinct())
+        follows = []
+        for follower_id in follower_ids:
+            follows.append(Follow(user_id=follower_id, author=author))
+            follows.extend(
+                Follow(user_id=follower_id, author_id=author_id)
+                for author_id in self.rng.sample(
+                    other_authors, min(options['follows'], len(other_authors))
+                )
+            )
+        Follow.objects.bulk_create(
+            follows, batch_size=1000, ignore_conflicts=True
+        )
+        reconcile_counters()
+        # Подписки созданы в обход API, и рецептов автора нет в лентах
+        self.set_mode(author, True)
+        author.refresh_from_db()
+        return author, follower_ids
+
+    def set_mode(self, author, fanout_on_read):
+        User.objects.filter(id=author.id).update(
+            feed_fanout_on_read=fanout_on_read
+        )
+        author.feed_fanout_on_read = fanout_on_read
+
+    @transaction.atomic
+    def publish(self, author, template, count, fanout_on_read):
+        self.set_mode(author, fanout_on_read)
+        # С нулевым лимитом автор остается в режиме чтения
+        limit = 0 if fanout_on_read else NO_LIMIT
+        recipes = self.create_recipes(author, count, template)
+        times = []
+        entries = 0
+        for recipe in recipes:
+            elapsed, created = self.timed(fan_out_recipe, recipe, limit)
+            times.append(elapsed)
+            entries += created
+        return statistics.median(times), entries, recipes
+
+    def read(self, samples, get_queryset):
+        times = []
+        pages = []
+        for user_id in samples:
+            elapsed, page = self.timed(lambda: list(
+                get_queryset(user_id).values_list(
+                    'id', flat=True
+                )[:settings.PAGE_SIZE]
+            ))
+            times.append(elapsed)
+            pages.append(page)
+        return statistics.median(times), pages
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        template = Recipe.objects.exclude(author__email=AUTHOR_EMAIL).first()
+        if template is None:
+            raise CommandError('Нет рецептов, сначала выполните seed_data')
+        elapsed, (author, follower_ids) = self.timed(
+            self.prepare, options, template
+        )
+        self.stdout.write(
+            f'Подписчиков у автора: {author.followers_count}, '
+            f'подписок у подписчика: {options["follows"] + 1}, '
+            f'подготовка: {elapsed:.1f} с'
+        )
+        samples = self.rng.sample(
+            follower_ids, min(options['samples'], len(follower_ids))
+        )
+        published = []
+        for name, fanout_on_read in MODES:
+            elapsed, entries, recipes = self.publish(
+                author, template, options['publish'], fanout_on_read
+            )
+            published.extend(recipe.id for recipe in recipes)
+            self.stdout.write(
+                f'Публикация, fan-out-on-{name}: '
+                f'{elapsed * 1000:8.2f} мс на рецепт, '
+                f'записей в лентах: {entries}'
+            )
+
+        results = {}
+        join_time, join_pages = self.read(
+            samples,
+            lambda user_id: Recipe.objects.filter(
+                author__followings__user=user_id
+            ),
+        )
+        for name, fanout_on_read in MODES:
+            self.set_mode(author, fanout_on_read)
+            rebuild_feeds(user_ids=samples)
+            results[name] = self.read(
+                samples,
+                lambda user_id: get_feed(
+                    User(id=user_id), Recipe.objects.all()
+                ),
+            )
+        self.stdout.write(
+            f'Чтение первой страницы: JOIN {join_time * 1000:.2f} мс, '
+            + ', '.join(
+                f'fan-out-on-{name} {elapsed * 1000:.2f} мс'
+                for name, (elapsed, _) in results.items()
+            )
+        )
+
+        # Рецепты бенчмарка удаляются. Рецептов автора нет в лентах
+        # остальных подписчиков, поэтому он остается в режиме чтения, пока
+        # trim_feeds не вернет его к записи
+        Recipe.objects.filter(id__in=published).delete()
+        self.set_mode(author, True)
+        rebuild_feeds(user_ids=samples)
+        if any(pages != join_pages for _, pages in results.values()):
+            raise CommandError('Ленты различаются')
+        self.stdout.write(self.style.SUCCESS('Ленты совпадают'))
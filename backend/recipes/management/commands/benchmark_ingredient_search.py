@@ -0,0 +1,61 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.ingredient_index import IngredientPrefixIndex
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск ингредиентов по префиксу через ORM '
+            '(istartswith) и через индекс в памяти')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=500,
+                            help='Количество поисковых запросов')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            raise CommandError('Таблица ингредиентов пуста')
+        # Имитируем набор текста: префиксы длиной от 1 до 5 символов
+        rng = random.Random(options['seed'])
+        prefixes = [
+            name[:rng.randint(1, 5)]
+            for name in rng.choices(names, k=options['queries'])
+        ]
+
+        start = time.perf_counter()
+        orm_found = 0
+        for prefix in prefixes:
+            orm_found += len(Ingredient.objects.filter(
+                name__istartswith=prefix
+            ).values('id', 'name', 'measurement_unit'))
+        orm_time = time.perf_counter() - start
+
+        index = IngredientPrefixIndex()
+        start = time.perf_counter()
+        index.get_data()
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index_found = 0
+        for prefix in prefixes:
+            index_found += len(index.search(prefix))
+        index_time = time.perf_counter() - start
+
+        count = len(prefixes)
+        self.stdout.write(f'Ингредиентов: {len(names)}, запросов: {count}')
+        self.stdout.write(
+            f'ORM:    {orm_time * 1000 / count:.3f} мс/запрос, '
+            f'найдено {orm_found}'
+        )
+        self.stdout.write(
+            f'Индекс: {index_time * 1000 / count:.3f} мс/запрос, '
+            f'найдено {index_found}, построение {build_time * 1000:.1f} мс'
+        )
+        self.stdout.write(
+            f'Ускорение: x{orm_time / max(index_time, 1e-9):.1f}'
+        )
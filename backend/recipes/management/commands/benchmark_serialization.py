@@ -0,0 +1,126 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.renderers import FastJSONRenderer, orjson
+from api.views import IngredientViewSet, RecipeViewSet, TagViewSet
+from recipes.models import Recipe
+
+User = get_user_model()
+
+ENDPOINTS = (
+    ('recipes', RecipeViewSet, '/api/recipes/'),
+    ('recipes cursor', RecipeViewSet, '/api/recipes/?cursor='),
+    ('tags', TagViewSet, '/api/tags/'),
+    ('ingredients', IngredientViewSet, '/api/ingredients/'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Проверяет, что быстрая сериализация списков дает те же байты, '
+            'что и сериализаторы DRF, и сравнивает скорость')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Количество запросов на каждый вариант')
+        parser.add_argument('--limit', type=int, default=6,
+                            help='Размер страницы рецептов')
+        parser.add_argument('--user', help='Email пользователя-зрителя, '
+                                           'по умолчанию аноним')
+
+    def get_user(self, email):
+        if email is None:
+            return None
+        try:
+            return User.objects.get(email=email)
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {email} не найден')
+
+    def request(self, viewset, url, user, fast):
+        request = APIRequestFactory().get(url)
+        if user is not None:
+            force_authenticate(request, user=user)
+        view = viewset.as_view({'get': 'list'})
+        with override_settings(API_FAST_SERIALIZATION=fast):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = view(request)
+                response.render()
+                elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise CommandError(f'{url}: статус {response.status_code}')
+        return response, elapsed, len(queries)
+
+    def measure(self, viewset, url, user, fast, repeat):
+        times = []
+        for _ in range(repeat):
+            response, elapsed, queries = self.request(
+                viewset, url, user, fast
+            )
+            times.append(elapsed)
+        return response, statistics.median(times), queries
+
+    def handle(self, *args, **options):
+        if not Recipe.objects.exists():
+            raise CommandError('Нет рецептов для проверки')
+        user = self.get_user(options['user'])
+        repeat = options['repeat']
+        self.stdout.write(
+            f'JSON: {"orjson" if orjson is not None else "json"}, '
+            f'запросов на вариант: {repeat}'
+        )
+        failed = []
+        for title, viewset, url in ENDPOINTS:
+            if viewset is RecipeViewSet:
+                separator = '&' if '?' in url else '?'
+                url = f'{url}{separator}limit={options["limit"]}'
+            slow, slow_time, slow_queries = self.measure(
+                viewset, url, user, False, repeat
+            )
+            fast, fast_time, fast_queries = self.measure(
+                viewset, url, user, True, repeat
+            )
+            equal = slow.content == fast.content
+            if not equal:
+                failed.append(title)
+            self.stdout.write(
+                f'{title:<15} DRF {slow_time * 1000:7.2f} мс '
+                f'({slow_queries} запр.), '
+                f'быстрый {fast_time * 1000:7.2f} мс '
+                f'({fast_queries} запр.), '
+                f'x{slow_time / max(fast_time, 1e-9):.2f}, '
+                f'{len(fast.content)} байт, '
+                f'{"совпадает" if equal else "РАЗЛИЧАЕТСЯ"}'
+            )
+
+        # Отдельно сравниваем только кодирование JSON
+        data = RecipeViewSet.as_view({'get': 'list'})(
+            APIRequestFactory().get(f'/api/recipes/?limit={options["limit"]}')
+        ).data
+        timings = {}
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                content = renderer.render(data)
+            timings[type(renderer).__name__] = (
+                (time.perf_counter() - start) / repeat, content
+            )
+        (slow_time, slow_content), (fast_time, fast_content) = (
+            timings.values()
+        )
+        if slow_content != fast_content:
+            failed.append('renderer')
+        self.stdout.write(
+            f'{"JSON renderer":<15} DRF {slow_time * 1e6:7.1f} мкс, '
+            f'быстрый {fast_time * 1e6:7.1f} мкс, '
+            f'x{slow_time / max(fast_time, 1e-9):.2f}'
+        )
+        if failed:
+            raise CommandError('Ответы различаются: ' + ', '.join(failed))
+        self.stdout.write(self.style.SUCCESS('Все ответы совпадают побайтно'))
@@ -0,0 +1,85 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.http import QueryDict
+
+from api.filters import FilterForRecipes
+from recipes.models import Recipe, Tag
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает фильтрацию рецептов по тегам в FilterForRecipes '
+            'с прежним JOIN и DISTINCT')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--max-tags', type=int, default=3)
+
+    def join_queryset(self, tag_ids, match):
+        # Прежний способ: JOIN через таблицу связей с DISTINCT. Режима
+        # all раньше не было, для сравнения — JOIN на каждый тег
+        queryset = Recipe.objects.all()
+        if match == 'all':
+            for tag_id in tag_ids:
+                queryset = queryset.filter(tags=tag_id)
+            return queryset
+        return queryset.filter(tags__in=tag_ids).distinct()
+
+    def filterset_queryset(self, slugs, match):
+        data = QueryDict(mutable=True)
+        data.setlist('tags', slugs)
+        data['tags_match'] = match
+        filterset = FilterForRecipes(data, queryset=Recipe.objects.all())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors)
+        return filterset.qs
+
+    def measure(self, get_queryset, repeat):
+        # Как у пагинатора: COUNT и первая страница
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            queryset = get_queryset()
+            count = queryset.count()
+            page = list(
+                queryset.values_list('id', flat=True)[:settings.PAGE_SIZE]
+            )
+            times.append(time.perf_counter() - start)
+        return statistics.median(times), count, page
+
+    def handle(self, *args, **options):
+        # Самые популярные теги: худший случай для JOIN с DISTINCT
+        tags = list(Tag.objects.annotate(
+            recipes_total=Count('recipes')
+        ).order_by('-recipes_total', 'id')[:options['max_tags']])
+        if not tags:
+            raise CommandError('Нет тегов, сначала выполните seed_data')
+        self.stdout.write(f'Рецептов: {Recipe.objects.count()}')
+        failed = False
+        for size in range(1, len(tags) + 1):
+            tag_ids = [tag.id for tag in tags[:size]]
+            slugs = [tag.slug for tag in tags[:size]]
+            for match in ('any', 'all'):
+                join_time, join_count, join_page = self.measure(
+                    lambda: self.join_queryset(tag_ids, match),
+                    options['repeat'],
+                )
+                filterset_time, filterset_count, filterset_page = self.measure(
+                    lambda: self.filterset_queryset(slugs, match),
+                    options['repeat'],
+                )
+                equal = (join_count == filterset_count
+                         and join_page == filterset_page)
+                failed = failed or not equal
+                self.stdout.write(
+                    f'тегов {size}, {match:<3}: найдено {filterset_count:>7}, '
+                    f'JOIN {join_time * 1000:8.2f} мс, '
+                    f'фильтр {filterset_time * 1000:8.2f} мс, '
+                    f'x{join_time / max(filterset_time, 1e-9):.2f}'
+                    + ('' if equal else ', РЕЗУЛЬТАТЫ РАЗЛИЧАЮТСЯ')
+                )
+        if failed:
+            raise CommandError('Результаты фильтрации различаются')
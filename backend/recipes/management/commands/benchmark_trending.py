@@ -0,0 +1,130 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from recipes.models import Favorite, Recipe, ShoppingCart, TrendingState
+from recipes.trending import get_decay, update_trending
+
+# Размеры данных для --seed: избранное распределяется по пользователям
+SEED_USERS = 2000
+SEED_RECIPES = 20000
+SEED_DAYS = 30
+# Допустимое относительное расхождение инкрементального и полного расчета
+TOLERANCE = 1e-9
+
+
+class Command(BaseCommand):
+    help = ('Измеряет полный и инкрементальный пересчет популярности '
+            'рецептов и сравнивает выборку популярных с агрегацией '
+            'избранного и корзин на лету')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--favorites', type=int, default=10 ** 6,
+                            help='Ожидаемое число записей избранного')
+        parser.add_argument('--seed', action='store_true',
+                            help='Создать данные через seed_data, если '
+                                 'избранного меньше --favorites')
+        parser.add_argument('--window', type=int, default=120,
+                            help='Промежуток инкрементального пересчета, '
+                                 'минуты')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def timed(self, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        return time.perf_counter() - start, result
+
+    def count_events(self, model, since):
+        return Coalesce(Subquery(
+            model.objects.filter(
+                recipe=OuterRef('pk'), created__gte=since
+            ).order_by().values('recipe').annotate(
+                total=Count('id')
+            ).values('total')
+        ), 0)
+
+    def get_scores(self):
+        state = TrendingState.objects.get()
+        return state.epoch, dict(
+            Recipe.objects.values_list('id', 'trending_score')
+        )
+
+    def seed(self, favorites):
+        call_command(
+            'seed_data',
+            users=SEED_USERS,
+            recipes=SEED_RECIPES,
+            favorites=-(-favorites // SEED_USERS),
+            carts=5,
+            follows=5,
+            days=SEED_DAYS,
+            stdout=self.stdout,
+        )
+
+    def handle(self, *args, **options):
+        favorites = Favorite.objects.count()
+        if favorites < options['favorites'] and options['seed']:
+            self.seed(options['favorites'] - favorites)
+            favorites = Favorite.objects.count()
+        if not favorites:
+            raise CommandError('Нет избранного, запустите команду с --seed')
+        self.stdout.write(
+            f'Рецептов: {Recipe.objects.count()}, избранного: {favorites}, '
+            f'в корзинах: {ShoppingCart.objects.count()}'
+        )
+        now = timezone.now()
+        window = timedelta(minutes=options['window'])
+
+        full_time, updated = self.timed(update_trending, full=True, now=now)
+        self.stdout.write(
+            f'Полный пересчет: {full_time:.2f} с, рецептов: {updated}'
+        )
+        full_epoch, full_scores = self.get_scores()
+
+        update_trending(full=True, now=now - window)
+        incremental_time, updated = self.timed(update_trending, now=now)
+        self.stdout.write(
+            f'Инкрементальный пересчет за {options["window"]} мин: '
+            f'{incremental_time * 1000:.1f} мс, рецептов: {updated}'
+        )
+        # Значения приводятся к точке отсчета полного пересчета
+        epoch, scores = self.get_scores()
+        factor = get_decay(full_epoch - epoch)
+        error = max(
+            abs(scores[pk] * factor - score) / max(score, 1e-300)
+            for pk, score in full_scores.items()
+        )
+        self.stdout.write(f'Расхождение с полным пересчетом: {error:.2e}')
+
+        page = settings.PAGE_SIZE
+        stored_time = min(
+            self.timed(lambda: list(Recipe.objects.order_by(
+                '-trending_score', '-id'
+            ).values_list('id', flat=True)[:page]))[0]
+            for _ in range(options['repeat'])
+        )
+        # Для сравнения: события за неделю без затухания, подсчет на лету
+        week = now - timedelta(days=7)
+        live_time = min(
+            self.timed(lambda: list(Recipe.objects.annotate(
+                score=self.count_events(Favorite, week)
+                + self.count_events(ShoppingCart, week)
+            ).order_by('-score', '-id').values_list('id', flat=True)[:page]
+            ))[0]
+            for _ in range(options['repeat'])
+        )
+        self.stdout.write(
+            f'Страница популярных: по индексу {stored_time * 1000:.2f} мс, '
+            f'агрегацией {live_time * 1000:.2f} мс, '
+            f'x{live_time / max(stored_time, 1e-9):.1f}'
+        )
+        if error > TOLERANCE:
+            raise CommandError(
+                'Инкрементальный пересчет расходится с полным'
+            )
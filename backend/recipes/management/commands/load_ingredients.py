@@ -0,0 +1,140 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.models import Ingredient
+from recipes.versions import bump_table_version
+
+DEFAULT_PATH = Path(settings.BASE_DIR).parent / 'data' / 'ingredients.csv'
+READ_SIZE = 64 * 1024
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def iter_json(file):
+    '''Читает JSON-массив объектов по частям, не загружая файл целиком.'''
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидался JSON-массив ингредиентов')
+    position = 1
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Объект не поместился в прочитанную часть, дочитываем файл
+            if eof:
+                raise CommandError('Некорректный JSON')
+            chunk = file.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item['name'], item['measurement_unit']
+
+
+READERS = {'csv': iter_csv, 'json': iter_json}
+
+
+class Command(BaseCommand):
+    help = ('Загружает ингредиенты из CSV или JSON пакетами. Повторный '
+            'запуск не создает дубликатов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_PATH))
+        parser.add_argument('--format', choices=READERS,
+                            help='По умолчанию определяется по расширению')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def iter_unique(self, rows):
+        # Убираем дубликаты по паре (название, единица измерения)
+        self.seen = set()
+        for name, unit in rows:
+            key = (name.strip(), unit.strip())
+            if key[0] and key[1] and key not in self.seen:
+                self.seen.add(key)
+                yield key
+
+    def load_postgresql(self, rows, batch_size):
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE tmp_ingredients '
+                '(name varchar(200), measurement_unit varchar(50)) '
+                'ON COMMIT DROP'
+            )
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    'COPY tmp_ingredients (name, measurement_unit) '
+                    'FROM STDIN WITH (FORMAT csv)',
+                    buffer
+                )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT name, measurement_unit FROM tmp_ingredients '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return cursor.rowcount
+
+    def load_bulk_create(self, rows, batch_size):
+        before = Ingredient.objects.count()
+        while True:
+            batch = [
+                Ingredient(name=name, measurement_unit=unit)
+                for name, unit in islice(rows, batch_size)
+            ]
+            if not batch:
+                break
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        return Ingredient.objects.count() - before
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+
+        start = time.perf_counter()
+        with open(path, encoding='utf-8') as file:
+            rows = self.iter_unique(READERS[file_format](file))
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    created = self.load_postgresql(
+                        rows, options['batch_size'])
+                else:
+                    created = self.load_bulk_create(
+                        rows, options['batch_size'])
+        elapsed = time.perf_counter() - start
+        # Массовая вставка не отправляет сигналы, обновляем версию вручную
+        bump_table_version(Ingredient)
+
+        processed = len(self.seen)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано уникальных строк: {processed}, '
+            f'добавлено: {created}, время: {elapsed:.3f} с, '
+            f'скорость: {processed / max(elapsed, 1e-9):.0f} строк/с'
+        ))
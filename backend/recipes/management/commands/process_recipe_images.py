@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создает производные размеры изображений для рецептов, '
+            'у которых их еще нет')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Обработать все изображения заново')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        names = recipes.values_list('image', flat=True).distinct()
+        processed = 0
+        for name in names.order_by('image').iterator():
+            try:
+                process_recipe_image(name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{name}: {error}')
+                continue
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {processed}'
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import rebuild_feeds
+
+
+class Command(BaseCommand):
+    help = 'Заполняет ленты подписок заново по текущим подпискам'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            created = rebuild_feeds()
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {created}, '
+            f'время: {time.perf_counter() - start:.1f} с'
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Recipe
+from recipes.search import update_search_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс рецептов'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            update_search_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {Recipe.objects.count()}, '
+            f'время: {time.perf_counter() - start:.1f} с'
+        ))
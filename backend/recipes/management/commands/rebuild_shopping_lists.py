@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+from recipes.shopping_list import get_live_shopping_lists
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает сводные списки покупок из корзин и сверяет '
+            'их с группировкой по живым данным')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only', action='store_true',
+            help='Только сверить, ничего не изменяя'
+        )
+
+    def get_stored(self):
+        return {
+            (user_id, pk): amount
+            for user_id, pk, amount in ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+
+    def verify(self):
+        live = get_live_shopping_lists()
+        stored = self.get_stored()
+        mismatched = {
+            key for key in live.keys() | stored.keys()
+            if live.get(key) != stored.get(key)
+        }
+        for user_id, pk in sorted(mismatched)[:20]:
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {pk}: '
+                f'сохранено {stored.get((user_id, pk))}, '
+                f'должно быть {live.get((user_id, pk))}'
+            )
+        return len(live), len(mismatched)
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            with transaction.atomic():
+                ShoppingListItem.objects.all().delete()
+                ShoppingListItem.objects.bulk_create(
+                    (
+                        ShoppingListItem(
+                            user_id=user_id, ingredient_id=pk, amount=total
+                        )
+                        for (user_id, pk), total
+                        in get_live_shopping_lists().items()
+                    ),
+                    batch_size=1000,
+                )
+        total, mismatched = self.verify()
+        if mismatched:
+            raise CommandError(f'Расхождений: {mismatched} из {total}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок совпадают, строк: {total}'
+        ))
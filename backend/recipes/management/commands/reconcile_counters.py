@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счетчики избранного, корзин, подписчиков и рецептов '
+            'с фактическими данными и исправляет расхождения')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only', action='store_true',
+            help='Только сверить, ничего не изменяя'
+        )
+
+    def handle(self, *args, **options):
+        fix = not options['verify_only']
+        with transaction.atomic():
+            drift = reconcile_counters(fix=fix)
+        total = 0
+        for (label, field), ids in drift.items():
+            total += len(ids)
+            if ids:
+                self.stdout.write(
+                    f'{label}.{field}: расхождений {len(ids)}, '
+                    f'например id {ids[:10]}'
+                )
+        if total and not fix:
+            raise CommandError(f'Расхождений: {total}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков: {total}' if total
+            else 'Счетчики совпадают'
+        ))
@@ -0,0 +1,268 @@
+import hashlib
+import io
+import random
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from PIL import Image
+
+from recipes.counters import reconcile_counters
+from recipes.feed import rebuild_feeds
+from recipes.models import (AmountIngredient, Favorite, Ingredient, Recipe,
+                            ShoppingCart, Tag)
+from recipes.search import update_search_index
+from recipes.trending import update_trending
+from recipes.versions import bump_table_version
+from users.models import Follow
+
+User = get_user_model()
+
+# Сгенерированные пользователи и теги отличаются по домену почты и слагу,
+# поэтому их можно удалить, не трогая настоящие данные
+SEED_DOMAIN = 'seed.foodgram.local'
+SEED_TAG_PREFIX = 'seed-'
+TAG_NAMES = (
+    'Завтрак', 'Обед', 'Ужин', 'Десерт', 'Выпечка', 'Суп', 'Салат',
+    'Закуска', 'Напиток', 'Постное', 'Быстро', 'Праздник',
+)
+# Шагов времени добавления в избранное и корзину на сутки
+SPREAD_STEPS_PER_DAY = 24
+DISHES = ('Салат', 'Суп', 'Пирог', 'Рагу', 'Запеканка', 'Омлет', 'Соус',
+          'Каша', 'Паста', 'Пудинг')
+
+
+class Command(BaseCommand):
+    help = ('Создает воспроизводимый синтетический набор данных: '
+            'пользователей, рецепты, теги, избранное, корзины и подписки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=8,
+                            help=f'Не больше {len(TAG_NAMES)}')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Среднее число избранных на пользователя')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Среднее число рецептов в корзине')
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Среднее число подписок на пользователя')
+        parser.add_argument('--images', type=int, default=10,
+                            help='Количество разных изображений')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Период дат публикации рецептов')
+        parser.add_argument('--password', default='seed-password')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Сначала удалить ранее созданные данные')
+
+    def clear(self):
+        User.objects.filter(email__endswith='@' + SEED_DOMAIN).delete()
+        Tag.objects.filter(slug__startswith=SEED_TAG_PREFIX).delete()
+
+    def get_counts(self, average):
+        # Число связей у пользователя от 0 до удвоенного среднего
+        return self.rng.randint(0, 2 * average)
+
+    def create_tags(self, count):
+        Tag.objects.bulk_create(
+            (
+                Tag(
+                    name=name,
+                    color='#{:06x}'.format(self.rng.randrange(0x1000000)),
+                    slug=f'{SEED_TAG_PREFIX}{index}',
+                )
+                for index, name in enumerate(TAG_NAMES[:count])
+            ),
+            ignore_conflicts=True,
+        )
+        return list(Tag.objects.filter(
+            slug__startswith=SEED_TAG_PREFIX
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_users(self, count, password):
+        start = User.objects.filter(email__endswith='@' + SEED_DOMAIN).count()
+        # Хэш пароля дорогой, вычисляем его один раз для всех
+        password = make_password(password)
+        users = [
+            User(
+                email=f'user{number}@{SEED_DOMAIN}',
+                username=f'seed_user{number}',
+                first_name='Имя',
+                last_name=f'Фамилия {number}',
+                password=password,
+            )
+            for number in range(start, start + count)
+        ]
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        return list(User.objects.filter(
+            email__endswith='@' + SEED_DOMAIN
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_images(self, count):
+        names = []
+        for _ in range(count):
+            color = tuple(self.rng.randrange(256) for _ in range(3))
+            buffer = io.BytesIO()
+            Image.new('RGB', (320, 240), color).save(buffer, 'PNG')
+            content = buffer.getvalue()
+            # Имена по хэшу содержимого, как у загруженных через API
+            name = f'recipes/{hashlib.sha256(content).hexdigest()}.png'
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(content))
+            names.append(name)
+        return names
+
+    def create_recipes(self, count, user_ids, images, days):
+        today = date.today()
+        recipes = [
+            Recipe(
+                author_id=self.rng.choice(user_ids),
+                name=f'{self.rng.choice(DISHES)} №{number}',
+                text='Синтетический рецепт для нагрузочного тестирования',
+                cooking_time=self.rng.randint(5, 180),
+                image=self.rng.choice(images),
+            )
+            for number in range(count)
+        ]
+        recipes = Recipe.objects.bulk_create(
+            recipes, batch_size=self.batch_size
+        )
+        # pub_date заполняется автоматически, распределяем даты отдельно
+        by_date = {}
+        for recipe in recipes:
+            pub_date = today - timedelta(days=self.rng.randrange(days))
+            by_date.setdefault(pub_date, []).append(recipe.id)
+        for pub_date, ids in by_date.items():
+            Recipe.objects.filter(id__in=ids).update(pub_date=pub_date)
+        return [recipe.id for recipe in recipes]
+
+    def create_recipe_relations(self, recipe_ids, ingredient_ids, tag_ids):
+        amounts = []
+        tags = []
+        for recipe_id in recipe_ids:
+            # В большинстве рецептов 4-8 ингредиентов
+            count = round(self.rng.triangular(2, 15, 6))
+            for ingredient_id in self.rng.sample(
+                ingredient_ids, min(count, len(ingredient_ids))
+            ):
+                amounts.append(AmountIngredient(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.rng.choice((1, 2, 3, 5, 10, 50, 100, 200)),
+                ))
+            for tag_id in self.rng.sample(
+                tag_ids, min(self.rng.randint(1, 3), len(tag_ids))
+            ):
+                tags.append(Recipe.tags.through(
+                    recipe_id=recipe_id, tag_id=tag_id
+                ))
+        AmountIngredient.objects.bulk_create(
+            amounts, batch_size=self.batch_size
+        )
+        Recipe.tags.through.objects.bulk_create(
+            tags, batch_size=self.batch_size
+        )
+        return len(amounts)
+
+    def create_user_relations(self, model, field, user_ids, target_ids,
+                              average):
+        objects = []
+        for user_id in user_ids:
+            targets = self.rng.sample(
+                target_ids, min(self.get_counts(average), len(target_ids))
+            )
+            objects.extend(
+                model(user_id=user_id, **{field: target_id})
+                for target_id in targets
+                if not (model is Follow and target_id == user_id)
+            )
+        last_id = model.objects.aggregate(last_id=Max('id'))['last_id']
+        model.objects.bulk_create(
+            objects, batch_size=self.batch_size, ignore_conflicts=True
+        )
+        if model is not Follow:
+            self.spread_created(model, last_id or 0)
+        return len(objects)
+
+    def spread_created(self, model, last_id):
+        # created заполняется автоматически. Распределяем новые записи
+        # по последним дням (см. --days) в порядке id, как если бы они
+        # добавлялись постепенно: это нужно для расчета популярности
+        bounds = model.objects.filter(id__gt=last_id).aggregate(
+            first=Min('id'), last=Max('id')
+        )
+        if bounds['first'] is None:
+            return
+        now = timezone.now()
+        period = timedelta(days=self.days)
+        steps = self.days * SPREAD_STEPS_PER_DAY
+        size = (bounds['last'] - bounds['first'] + 1) / steps
+        for step in range(steps):
+            model.objects.filter(
+                id__gte=bounds['first'] + round(step * size),
+                id__lt=bounds['first'] + round((step + 1) * size),
+            ).update(created=now - period * (1 - step / steps))
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.days = max(options['days'], 1)
+        start = time.perf_counter()
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        images = self.create_images(max(options['images'], 1))
+
+        with transaction.atomic():
+            if options['clear']:
+                self.clear()
+            tag_ids = self.create_tags(options['tags'])
+            user_ids = self.create_users(
+                options['users'], options['password']
+            )
+            recipe_ids = self.create_recipes(
+                options['recipes'], user_ids, images, self.days
+            )
+            amounts = self.create_recipe_relations(
+                recipe_ids, ingredient_ids, tag_ids
+            )
+            favorites = self.create_user_relations(
+                Favorite, 'recipe_id', user_ids, recipe_ids,
+                options['favorites'],
+            )
+            carts = self.create_user_relations(
+                ShoppingCart, 'recipe_id', user_ids, recipe_ids,
+                options['carts'],
+            )
+            follows = self.create_user_relations(
+                Follow, 'author_id', user_ids, user_ids, options['follows']
+            )
+        # Массовые вставки не обновляют сводные списки, счетчики, ленты
+        # и версии таблиц
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        reconcile_counters()
+        rebuild_feeds()
+        update_search_index()
+        update_trending(full=True)
+        bump_table_version(Tag)
+        bump_table_version(Ingredient)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {len(user_ids)}, рецептов: {len(recipe_ids)}, '
+            f'ингредиентов в рецептах: {amounts}, тегов: {len(tag_ids)}, '
+            f'избранного: {favorites}, в корзинах: {carts}, '
+            f'подписок: {follows}, '
+            f'время: {time.perf_counter() - start:.1f} с'
+        ))
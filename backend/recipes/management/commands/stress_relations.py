@@ -0,0 +1,214 @@
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from recipes.counters import RECIPE_COUNTERS
+from recipes.models import Favorite, Recipe, ShoppingCart, ShoppingListItem
+from recipes.shopping_list import get_live_shopping_lists
+from users.models import Follow
+from .benchmark_api import ClientTransport, HTTPTransport
+from .seed_data import SEED_DOMAIN
+
+User = get_user_model()
+
+# Действие: (путь, пакетный путь, модель связи, поле связи,
+# модель счетчика)
+ACTIONS = (
+    ('/api/recipes/{}/favorite/', '/api/recipes/favorite/',
+     Favorite, 'recipe', Recipe),
+    ('/api/recipes/{}/shopping_cart/', '/api/recipes/shopping_cart/',
+     ShoppingCart, 'recipe', Recipe),
+    ('/api/users/{}/subscribe/', '/api/users/subscribe/',
+     Follow, 'author', User),
+)
+COUNTER_FIELDS = {
+    Favorite: RECIPE_COUNTERS[Favorite],
+    ShoppingCart: RECIPE_COUNTERS[ShoppingCart],
+    Follow: 'followers_count',
+}
+# Из одновременных запросов ровно один меняет связь, остальные
+# получают ошибку клиента. Для пакетных запросов результат — статус
+# id в ответе
+EXPECTED = {
+    'POST': ((201, 'created'), (400, 'exists')),
+    'DELETE': ((204, 'deleted'), (400, 'missing')),
+}
+
+
+class Command(BaseCommand):
+    help = ('Отправляет одновременные одиночные и пакетные запросы на '
+            'добавление и удаление избранного, корзины и подписки и '
+            'проверяет, что нет ответов 500, дублей связей и расхождений '
+            'счетчиков и списков покупок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Одновременных запросов на действие')
+        parser.add_argument('--user', help='Email пользователя для запросов, '
+                                           'по умолчанию первый из seed_data')
+        parser.add_argument('--base-url',
+                            help='Адрес запущенного сервера; по умолчанию '
+                                 'тестовый клиент в этом процессе')
+
+    def get_targets(self, user):
+        # Объекты, которых у пользователя еще нет: каждый раунд
+        # добавляет и удаляет связи с ними
+        recipe = Recipe.objects.exclude(
+            id__in=Favorite.objects.filter(user=user).values('recipe_id')
+        ).exclude(
+            id__in=ShoppingCart.objects.filter(user=user).values('recipe_id')
+        ).order_by('id').first()
+        author = User.objects.exclude(id=user.id).exclude(
+            id__in=Follow.objects.filter(user=user).values('author_id')
+        ).order_by('id').first()
+        if recipe is None or author is None:
+            raise CommandError('Нет рецепта или автора без связи '
+                               'с пользователем, выполните seed_data')
+        return {
+            Favorite: recipe.id,
+            ShoppingCart: recipe.id,
+            Follow: author.id,
+        }
+
+    def fire(self, transport, requests, token):
+        # Барьер выравнивает старт запросов, как при двойном клике.
+        # requests — список (метод, путь, тело или None)
+        barrier = threading.Barrier(len(requests))
+
+        def request(arguments):
+            method, path, body = arguments
+            client = transport()
+            barrier.wait()
+            try:
+                status, content = client.request(
+                    method, path, body and json.dumps(body), token
+                )[:2]
+            except Exception as error:
+                # Тестовый клиент пробрасывает исключения представлений
+                return f'500 {type(error).__name__}: {error}'
+            finally:
+                # Соединения потоков с БД не переиспользуются
+                connection.close()
+            if body is None or status != 200:
+                return status
+            return json.loads(content)['results'][0]['status']
+
+        with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+            return Counter(executor.map(request, requests))
+
+    def get_requests(self, method, path, bulk_path, pk, concurrency, mixed):
+        # В смешанной серии каждый второй запрос пакетный
+        return [
+            (method, bulk_path, {'ids': [pk]}) if mixed and number % 2
+            else (method, path.format(pk), None)
+            for number in range(concurrency)
+        ]
+
+    def check_rows(self, user, model, field, pk, counter_model, expected):
+        rows = model.objects.filter(user=user, **{field: pk}).count()
+        counter = counter_model.objects.values_list(
+            COUNTER_FIELDS[model], flat=True
+        ).get(pk=pk)
+        actual = model.objects.filter(**{field: pk}).count()
+        errors = []
+        if rows != expected:
+            errors.append(f'строк связи {rows} вместо {expected}')
+        if counter != actual:
+            errors.append(f'счетчик {counter} при {actual} связях')
+        if model is ShoppingCart:
+            stored = dict(ShoppingListItem.objects.filter(
+                user=user
+            ).values_list('ingredient_id', 'amount'))
+            live = {
+                pk: amount for (_, pk), amount
+                in get_live_shopping_lists([user.id]).items()
+            }
+            if stored != live:
+                errors.append('список покупок расходится с корзиной')
+        return errors
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 2:
+            raise CommandError('Нужно хотя бы два одновременных запроса')
+        users = User.objects.filter(email__endswith='@' + SEED_DOMAIN)
+        if options['user']:
+            users = users.filter(email=options['user'])
+        user = users.exclude(email__startswith='benchmark').order_by(
+            'id'
+        ).first()
+        if user is None:
+            raise CommandError('Нет пользователя, выполните seed_data')
+        token = Token.objects.get_or_create(user=user)[0].key
+        targets = self.get_targets(user)
+        if options['base_url']:
+            def transport():
+                return HTTPTransport(options['base_url'])
+        else:
+            transport = ClientTransport
+
+        statuses = Counter()
+        failures = []
+        # Тестовый клиент обращается к хосту testserver
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for number in range(options['rounds']):
+                for path, bulk_path, model, field, counter_model in ACTIONS:
+                    pk = targets[model]
+                    for mixed, method, rows in (
+                        (False, 'POST', 1), (False, 'DELETE', 0),
+                        (True, 'POST', 1), (True, 'DELETE', 0),
+                    ):
+                        result = self.fire(transport, self.get_requests(
+                            method, path, bulk_path, pk,
+                            options['concurrency'], mixed,
+                        ), token)
+                        name = f'{method} {path}' + (
+                            f' + {bulk_path}' if mixed else ''
+                        )
+                        for status, count in result.items():
+                            statuses[name, status] += count
+                        success, error = EXPECTED[method]
+                        successes = sum(result[key] for key in success)
+                        errors = sum(result[key] for key in error)
+                        if (successes != 1 or errors
+                                != options['concurrency'] - 1):
+                            failures.append(
+                                f'раунд {number}, {name}: {dict(result)}'
+                            )
+                        failures.extend(
+                            f'раунд {number}, {name}: {message}'
+                            for message in self.check_rows(
+                                user, model, field, pk, counter_model, rows
+                            )
+                        )
+
+        for model, fields in ((Favorite, ('user', 'recipe')),
+                              (ShoppingCart, ('user', 'recipe')),
+                              (Follow, ('user', 'author'))):
+            duplicates = model.objects.values(*fields).annotate(
+                total=Count('id')
+            ).filter(total__gt=1).count()
+            if duplicates:
+                failures.append(
+                    f'{model.__name__}: {duplicates} повторяющихся связей'
+                )
+        for (name, status), count in sorted(
+            statuses.items(), key=lambda item: (item[0][0], str(item[0][1]))
+        ):
+            self.stdout.write(f'{name:<60} {status}: {count}')
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError(f'Нарушений: {len(failures)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Раундов: {options["rounds"]}, одновременных запросов: '
+            f'{options["concurrency"]}, нарушений нет'
+        ))
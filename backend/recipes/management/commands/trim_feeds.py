@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.feed import resume_fanout, trim_feeds
+
+
+class Command(BaseCommand):
+    help = ('Возвращает к записи в ленты авторов, у которых стало меньше '
+            'подписчиков, и обрезает ленты подписок до FEED_MAX_LENGTH '
+            'последних рецептов. Предназначена для периодического '
+            'запуска (cron)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-length', type=int, default=settings.FEED_MAX_LENGTH
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        resumed = resume_fanout()
+        deleted = trim_feeds(options['max_length'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Авторов возвращено к записи в ленты: {resumed}, '
+            f'удалено записей: {deleted}, '
+            f'время: {time.perf_counter() - start:.1f} с'
+        ))
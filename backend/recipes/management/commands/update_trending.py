@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.trending import update_trending
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает популярность рецептов по событиям с прошлого '
+            'запуска. Предназначена для периодического запуска (cron)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать заново по всем событиям'
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        updated = update_trending(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено рецептов: {updated}, '
+            f'время: {time.perf_counter() - start:.1f} с'
+        ))
@@ -0,0 +1,65 @@
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    # Оставляем ингредиент с наименьшим id и переносим на него рецепты.
+    # Ограничение уникальности добавляет следующая миграция: в PostgreSQL
+    # ALTER TABLE нельзя выполнить в транзакции, которая удаляла строки
+    # со ссылками (cannot ALTER TABLE because it has pending trigger
+    # events)
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    AmountIngredient = apps.get_model('recipes', 'AmountIngredient')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        keep_id = group['keep_id']
+        ids = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).values_list('id', flat=True))
+        amounts = AmountIngredient.objects.filter(ingredient_id__in=ids)
+        # Несколько дублей в одном рецепте складываются в одну строку,
+        # иначе они нарушили бы recipe_ingredient_constraint
+        for row in amounts.values('recipe_id').annotate(
+            total=Sum('amount'), rows=Count('id')
+        ).filter(rows__gt=1):
+            recipe_rows = amounts.filter(recipe_id=row['recipe_id'])
+            kept = recipe_rows.order_by('ingredient_id', 'id').first()
+            recipe_rows.exclude(id=kept.id).delete()
+            AmountIngredient.objects.filter(id=kept.id).update(
+                amount=row['total']
+            )
+        amounts.exclude(ingredient_id=keep_id).update(ingredient_id=keep_id)
+        # Списки покупок с этими ингредиентами считаются заново по
+        # корзинам, как в 0012_shoppinglistitem
+        ShoppingListItem.objects.filter(ingredient_id__in=ids).delete()
+        ShoppingListItem.objects.bulk_create(
+            (
+                ShoppingListItem(
+                    user_id=user_id, ingredient_id=keep_id, amount=total
+                )
+                for user_id, total in ShoppingCart.objects.filter(
+                    recipe__recipes__ingredient_id=keep_id
+                ).values_list('user_id').annotate(
+                    total=Sum('recipe__recipes__amount')
+                ).order_by()
+            ),
+            batch_size=1000,
+        )
+        Ingredient.objects.filter(id__in=ids).exclude(id=keep_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+    ]
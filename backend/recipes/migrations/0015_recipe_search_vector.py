@@ -0,0 +1,70 @@
+# Generated by Django 4.2.1 on 2026-10-18 17:28
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+INGREDIENT_NAMES = (
+    "(SELECT {agg} FROM recipes_amountingredient a "
+    "JOIN recipes_ingredient i ON i.id = a.ingredient_id "
+    "WHERE a.recipe_id = r.id)"
+)
+
+
+def fold(column):
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+# Индексы полнотекстового поиска зависят от СУБД и не описаны в модели
+# (см. recipes.search): GIN по search_vector в PostgreSQL, таблица FTS5
+# в SQLite
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX recipe_search_vector_idx ON recipes_recipe '
+            'USING gin (search_vector)'
+        )
+        names = INGREDIENT_NAMES.format(agg="string_agg(i.name, ' ')")
+        schema_editor.execute(
+            "UPDATE recipes_recipe r SET search_vector = "
+            "setweight(to_tsvector('russian', r.name), 'A') || "
+            "setweight(to_tsvector('russian', r.text), 'B') || "
+            f"setweight(to_tsvector('russian', coalesce({names}, '')), 'C')"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5('
+            "name, text, ingredients, tokenize = 'unicode61')"
+        )
+        names = INGREDIENT_NAMES.format(
+            agg=fold("group_concat(i.name, ' ')")
+        )
+        schema_editor.execute(
+            'INSERT INTO recipes_recipe_fts (rowid, name, text, ingredients) '
+            f"SELECT r.id, {fold('r.name')}, {fold('r.text')}, "
+            f"coalesce({names}, '') FROM recipes_recipe r"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
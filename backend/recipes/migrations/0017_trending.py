@@ -0,0 +1,73 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:02
+
+from datetime import datetime, time
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# Время добавления существующих записей неизвестно, берем дату публикации
+# рецепта: старые записи не попадут в популярные этой недели
+def fill_created(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    for model_name in ('Favorite', 'ShoppingCart'):
+        model = apps.get_model('recipes', model_name)
+        pub_dates = Recipe.objects.filter(
+            pk__in=model.objects.values('recipe_id')
+        ).values_list('pub_date', flat=True).distinct()
+        for pub_date in pub_dates:
+            model.objects.filter(recipe__pub_date=pub_date).update(
+                created=timezone.make_aware(datetime.combine(pub_date, time()))
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.DateTimeField(verbose_name='Точка отсчета')),
+                ('processed_until', models.DateTimeField(verbose_name='События учтены до')),
+            ],
+            options={
+                'verbose_name': 'Состояние популярности',
+                'verbose_name_plural': 'Состояние популярности',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Популярность'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-id'], name='recipe_trending_idx'),
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(null=True, verbose_name='Добавлено'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(null=True, verbose_name='Добавлено'),
+        ),
+        migrations.RunPython(fill_created, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Добавлено'),
+        ),
+        migrations.AlterField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Добавлено'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 
@@ -22,6 +23,12 @@ class Ingredient(models.Model):
         ordering = ('name', )
         verbose_name = 'Ингредиент',
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -71,6 +78,11 @@ class Recipe(models.Model):
         verbose_name='Изображение',
         upload_to='recipes/',
     )
+    image_variants = models.JSONField(
+        verbose_name='Производные изображения',
+        default=dict,
+        blank=True,
+    )
     text = models.TextField(
         max_length=200,
         verbose_name='Описание',
@@ -106,9 +118,40 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    # Счетчики поддерживаются представлениями API (см. recipes.counters)
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В корзинах',
+        default=0,
+    )
+    # Пересчитывается командой update_trending (см. recipes.trending)
+    trending_score = models.FloatField(
+        verbose_name='Популярность',
+        default=0,
+        editable=False,
+    )
+    # Заполняется recipes.search, используется только в PostgreSQL
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
 
     class Meta:
-        ordering = ('-pub_date', )
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('-trending_score', '-id'),
+                name='recipe_trending_idx'
+            ),
+        ]
         verbose_name = 'Рецепт',
         verbose_name_plural = 'Рецепты'
 
@@ -168,6 +211,11 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
     )
+    created = models.DateTimeField(
+        verbose_name='Добавлено',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -199,6 +247,11 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Пользователь'
     )
+    created = models.DateTimeField(
+        verbose_name='Добавлено',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -215,3 +268,110 @@ class ShoppingCart(models.Model):
             f'ShoppingCart: Пользователь {self.user.username}, '
             f'рецепт {self.recipe.name}'
         )
+
+
+class ShoppingListItem(models.Model):
+    '''Суммарное количество ингредиента в корзине пользователя.
+
+    Поддерживается приращениями при изменении корзины и ингредиентов
+    рецептов (см. recipes.shopping_list).
+    '''
+
+    user = models.ForeignKey(
+        User,
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField(
+        verbose_name='Количество',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount}'
+
+
+class TrendingState(models.Model):
+    '''Состояние пересчета популярности рецептов (одна строка).'''
+
+    epoch = models.DateTimeField(
+        verbose_name='Точка отсчета',
+    )
+    processed_until = models.DateTimeField(
+        verbose_name='События учтены до',
+    )
+
+    class Meta:
+        verbose_name = 'Состояние популярности'
+        verbose_name_plural = 'Состояние популярности'
+
+    def __str__(self):
+        return f'События учтены до {self.processed_until}'
+
+
+class FeedEntry(models.Model):
+    '''Рецепт в ленте подписок пользователя.
+
+    Записи создаются при публикации рецепта для всех подписчиков автора
+    (см. recipes.feed). Рецепты авторов с большим числом подписчиков
+    в ленты не пишутся и выбираются при чтении.
+    '''
+
+    user = models.ForeignKey(
+        User,
+        related_name='feed_entries',
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='feed_entries',
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт'
+    )
+    # Копии полей рецепта для отписки и обрезки ленты без JOIN
+    author = models.ForeignKey(
+        User,
+        related_name='+',
+        on_delete=models.CASCADE,
+        verbose_name='Автор'
+    )
+    pub_date = models.DateField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_entry_user_pub_date_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
@@ -0,0 +1,114 @@
+from django.db import connection
+from django.db.models.constants import OnConflict
+
+# Связи пользователя с рецептами и авторами (избранное, корзина,
+# подписки) защищены уникальными ограничениями. Проверка exists() перед
+# create() не спасает от двойного клика: оба запроса видят, что связи
+# нет, и второй падает с IntegrityError. Поэтому связь создается одним
+# условным INSERT, а удаляется одним DELETE, и ответ определяется
+# числом затронутых строк. Пакетные варианты возвращают (RETURNING)
+# ключи строк, которые действительно вставлены или удалены, чтобы
+# счетчики и списки покупок менялись только для них.
+
+
+def get_insert_sql(model, instances, returning=None):
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+    ops = connection.ops
+    columns = ', '.join(ops.quote_name(field.column) for field in fields)
+    row = '({})'.format(', '.join(['%s'] * len(fields)))
+    # INSERT ... ON CONFLICT DO NOTHING (INSERT IGNORE в MySQL)
+    sql = (
+        f'{ops.insert_statement(on_conflict=OnConflict.IGNORE)} '
+        f'{ops.quote_name(model._meta.db_table)} ({columns}) '
+        f'VALUES {", ".join([row] * len(instances))} '
+        f'{ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, [], [])}'
+    )
+    if returning is not None:
+        sql += f' RETURNING {ops.quote_name(returning.column)}'
+    params = [
+        field.get_db_prep_save(field.pre_save(instance, True), connection)
+        for instance in instances
+        for field in fields
+    ]
+    return sql, params
+
+
+def get_field_values(model, values):
+    # Значения столбцов для фильтра по полям модели (user=user и т. п.)
+    instance = model(**values)
+    fields = [model._meta.get_field(name) for name in values]
+    return {field.column: getattr(instance, field.attname) for field in fields}
+
+
+def insert_relation(model, **values):
+    '''Создает связь, если ее еще нет. Возвращает True, если создана.'''
+    sql, params = get_insert_sql(model, [model(**values)])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount > 0
+
+
+def delete_relation(model, **values):
+    '''Удаляет связь. Возвращает True, если она была.
+
+    У моделей связей нет сигналов и зависимых объектов, поэтому Django
+    удаляет их одним DELETE без предварительной выборки.
+    '''
+    deleted, _ = model.objects.filter(**values).delete()
+    return deleted > 0
+
+
+def insert_relations(model, field_name, pks, **values):
+    '''Создает связи с объектами pks по полю field_name.
+
+    Возвращает множество pks, для которых связь действительно создана.
+    '''
+    field = model._meta.get_field(field_name)
+    if not pks:
+        return set()
+    if not connection.features.can_return_rows_from_bulk_insert:
+        return {
+            pk for pk in pks
+            if insert_relation(model, **values, **{field.attname: pk})
+        }
+    sql, params = get_insert_sql(
+        model,
+        [model(**values, **{field.attname: pk}) for pk in pks],
+        returning=field,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {pk for pk, in cursor.fetchall()}
+
+
+def delete_relations(model, field_name, pks, **values):
+    '''Удаляет связи с объектами pks по полю field_name.
+
+    Возвращает множество pks, для которых связь действительно удалена.
+    '''
+    field = model._meta.get_field(field_name)
+    if not pks:
+        return set()
+    if not connection.features.can_return_rows_from_bulk_insert:
+        return {
+            pk for pk in pks
+            if delete_relation(model, **values, **{field.attname: pk})
+        }
+    ops = connection.ops
+    columns = get_field_values(model, values)
+    conditions = ' AND '.join(
+        f'{ops.quote_name(column)} = %s' for column in columns
+    )
+    column = ops.quote_name(field.column)
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {ops.quote_name(model._meta.db_table)} '
+            f'WHERE {conditions} AND {column} IN ({placeholders}) '
+            f'RETURNING {column}',
+            [*columns.values(), *pks],
+        )
+        return {pk for pk, in cursor.fetchall()}
@@ -0,0 +1,181 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import F, FloatField, OuterRef, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce
+
+from .ingredient_index import normalize
+from .models import AmountIngredient, Ingredient, Recipe
+
+# Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+# В PostgreSQL используется столбец search_vector (tsvector) с индексом
+# GIN и русским стеммингом, в SQLite — виртуальная таблица FTS5.
+# Индексы создаются миграцией 0015 только для своей СУБД, поэтому
+# в Meta.indexes модели их нет.
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# Веса названия, описания и ингредиентов
+WEIGHTS = ('A', 'B', 'C')
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+# Ограничение числа параметров запроса в SQLite
+BATCH_SIZE = 500
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def update_search_index(recipe_ids=None):
+    '''Обновляет поисковый индекс рецептов (всех, если ids не заданы).'''
+    if is_postgresql():
+        _update_postgresql(recipe_ids)
+    elif connection.vendor == 'sqlite':
+        if recipe_ids is None:
+            _update_sqlite(None)
+            return
+        recipe_ids = list(recipe_ids)
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            _update_sqlite(recipe_ids[start:start + BATCH_SIZE])
+
+
+def schedule_search_index(recipe_ids):
+    '''Обновляет индекс рецептов после фиксации текущей транзакции.
+
+    Рецепты, измененные в одной транзакции (сам рецепт и его
+    ингредиенты), индексируются одним вызовом update_search_index.
+    Вне транзакции индекс обновляется сразу.
+    '''
+    # Набор id хранится в соединении текущего потока
+    wrapper = transaction.get_connection()
+    wrapper.__dict__.setdefault('search_index_pending', set()).update(
+        recipe_ids
+    )
+    # Первый из зарегистрированных обработчиков забирает все id, после
+    # отката транзакции они останутся до следующей фиксации
+    transaction.on_commit(_flush_search_index)
+
+
+def _flush_search_index():
+    pending = transaction.get_connection().__dict__.pop(
+        'search_index_pending', None
+    )
+    if pending:
+        update_search_index(pending)
+
+
+def _update_postgresql(recipe_ids):
+    from django.contrib.postgres.aggregates import StringAgg
+    from django.contrib.postgres.search import SearchVector
+
+    ingredient_names = AmountIngredient.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(
+        names=StringAgg('ingredient__name', delimiter=' ')
+    ).values('names')
+    recipes = Recipe.objects.all()
+    if recipe_ids is not None:
+        recipes = recipes.filter(id__in=recipe_ids)
+    name_weight, text_weight, ingredients_weight = WEIGHTS
+    recipes.update(search_vector=(
+        SearchVector('name', config=SEARCH_CONFIG, weight=name_weight)
+        + SearchVector('text', config=SEARCH_CONFIG, weight=text_weight)
+        + SearchVector(
+            Coalesce(Subquery(ingredient_names), Value('')),
+            config=SEARCH_CONFIG,
+            weight=ingredients_weight,
+        )
+    ))
+
+
+def _fold(column):
+    # unicode61 не приравнивает "ё" к "е", делаем это при индексации
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _update_sqlite(recipe_ids):
+    condition, params = '', []
+    if recipe_ids is not None:
+        if not recipe_ids:
+            return
+        condition = 'IN ({})'.format(', '.join(['%s'] * len(recipe_ids)))
+        params = list(recipe_ids)
+    ingredient_names = _fold("group_concat(i.name, ' ')")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE}'
+            + (f' WHERE rowid {condition}' if condition else ''),
+            params
+        )
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) '
+            f'SELECT r.id, {_fold("r.name")}, {_fold("r.text")}, '
+            f"coalesce((SELECT {ingredient_names} "
+            f'FROM {AmountIngredient._meta.db_table} a '
+            f'JOIN {Ingredient._meta.db_table} i ON i.id = a.ingredient_id '
+            f"WHERE a.recipe_id = r.id), '') "
+            f'FROM {Recipe._meta.db_table} r'
+            + (f' WHERE r.id {condition}' if condition else ''),
+            params
+        )
+
+
+def remove_from_search_index(recipe_ids):
+    # В PostgreSQL вектор удаляется вместе со строкой рецепта
+    if connection.vendor != 'sqlite':
+        return
+    recipe_ids = list(recipe_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            batch = recipe_ids[start:start + BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+                batch
+            )
+
+
+def get_fts_query(query):
+    # Каждое слово ищется по префиксу: замена стемминга в FTS5
+    words = re.findall(r'\w+', normalize(query))
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_recipes(queryset, query):
+    '''Фильтрует рецепты по запросу и сортирует их по релевантности.
+
+    Релевантность доступна в аннотации search_rank (больше — лучше)
+    типа double precision: курсор пагинации хранит ее как float8, и
+    сравнение с real (ts_rank) на границе страницы не совпадало бы.
+    '''
+    if is_postgresql():
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        queryset = queryset.filter(search_vector=search_query).annotate(
+            # F(), а не строка: строку SearchRank оборачивает в
+            # SearchVector и заново строит вектор по тексту столбца
+            search_rank=Cast(
+                SearchRank(F('search_vector'), search_query), FloatField()
+            )
+        )
+    else:
+        fts_query = get_fts_query(query)
+        if not fts_query:
+            return queryset.none()
+        recipe_table = Recipe._meta.db_table
+        # bm25 отрицателен и тем меньше, чем лучше совпадение
+        weights = ', '.join(map(str, FTS_WEIGHTS))
+        queryset = queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [fts_query],
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = "{recipe_table}"."id"',
+            [fts_query],
+            output_field=FloatField(),
+        ))
+    return queryset.order_by('-search_rank', *Recipe._meta.ordering)
@@ -0,0 +1,111 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .models import AmountIngredient, ShoppingCart, ShoppingListItem
+
+
+def get_recipe_amounts(recipe):
+    # Словарь {id ингредиента: количество} для рецепта
+    return dict(
+        AmountIngredient.objects.filter(recipe=recipe)
+        .values_list('ingredient_id', 'amount')
+    )
+
+
+def apply_shopping_list_delta(user_ids, deltas):
+    '''Прибавляет deltas {id ингредиента: количество} к спискам покупок.
+
+    Выполняется тремя запросами независимо от числа строк: создание
+    недостающих строк, атомарное приращение через F() и удаление
+    обнулившихся строк.
+    '''
+    user_ids = list(user_ids)
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not user_ids or not deltas:
+        return
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas
+    )
+    with transaction.atomic():
+        ShoppingListItem.objects.bulk_create(
+            [
+                ShoppingListItem(user_id=user_id, ingredient_id=pk)
+                for user_id in user_ids
+                for pk, delta in deltas.items() if delta > 0
+            ],
+            ignore_conflicts=True,
+        )
+        items.update(amount=F('amount') + Case(
+            *[When(ingredient_id=pk, then=Value(delta))
+              for pk, delta in deltas.items()],
+            output_field=IntegerField(),
+        ))
+        items.filter(amount__lte=0).delete()
+
+
+def get_recipes_amounts(recipe_ids):
+    # Суммарные количества ингредиентов нескольких рецептов
+    return dict(
+        AmountIngredient.objects.filter(recipe_id__in=recipe_ids)
+        .order_by().values('ingredient_id').annotate(total=Sum('amount'))
+        .values_list('ingredient_id', 'total')
+    )
+
+
+def add_recipes_to_shopping_list(user, recipe_ids):
+    apply_shopping_list_delta([user.id], get_recipes_amounts(recipe_ids))
+
+
+def remove_recipes_from_shopping_list(user, recipe_ids):
+    amounts = get_recipes_amounts(recipe_ids)
+    apply_shopping_list_delta(
+        [user.id], {pk: -amount for pk, amount in amounts.items()}
+    )
+
+
+def add_recipe_to_shopping_list(user, recipe):
+    apply_shopping_list_delta([user.id], get_recipe_amounts(recipe))
+
+
+def remove_recipe_from_shopping_list(user, recipe):
+    amounts = get_recipe_amounts(recipe)
+    apply_shopping_list_delta(
+        [user.id], {pk: -amount for pk, amount in amounts.items()}
+    )
+
+
+def update_recipe_in_shopping_lists(recipe, old_amounts, new_amounts):
+    # Разница между старым и новым составом рецепта для всех
+    # пользователей, у которых рецепт лежит в корзине
+    deltas = Counter(new_amounts)
+    deltas.subtract(old_amounts)
+    user_ids = ShoppingCart.objects.filter(
+        recipe=recipe
+    ).values_list('user_id', flat=True)
+    apply_shopping_list_delta(user_ids, deltas)
+
+
+def remove_recipe_from_all_shopping_lists(recipe):
+    amounts = get_recipe_amounts(recipe)
+    user_ids = ShoppingCart.objects.filter(
+        recipe=recipe
+    ).values_list('user_id', flat=True)
+    apply_shopping_list_delta(
+        user_ids, {pk: -amount for pk, amount in amounts.items()}
+    )
+
+
+def get_live_shopping_lists(user_ids=None):
+    '''Списки покупок, посчитанные группировкой по корзинам.'''
+    carts = ShoppingCart.objects.all()
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+    rows = carts.values_list(
+        'user_id', 'recipe__recipes__ingredient_id'
+    ).annotate(total=Sum('recipe__recipes__amount')).order_by()
+    return {
+        (user_id, pk): total
+        for user_id, pk, total in rows.iterator() if pk is not None
+    }
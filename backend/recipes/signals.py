@@ -0,0 +1,42 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import AmountIngredient, Ingredient, Recipe, Tag
+from .search import (remove_from_search_index, schedule_search_index,
+                     update_search_index)
+from .versions import bump_table_version
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver([post_save, post_delete], sender=Tag)
+def bump_reference_version(sender, **kwargs):
+    # Новая версия сбрасывает ETag справочника и индекс ингредиентов
+    bump_table_version(sender)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search(sender, instance, created, **kwargs):
+    # Название ингредиента входит в поисковый индекс его рецептов
+    if not created:
+        update_search_index(
+            Recipe.objects.filter(ingredients=instance)
+            .values_list('id', flat=True)
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_search(sender, instance, **kwargs):
+    remove_from_search_index([instance.id])
+
+
+# Индекс обновляется при любой записи рецепта и его состава: через API,
+# админку, loaddata и ORM. Пакетные операции (bulk_create, update)
+# сигналов не вызывают, их код обновляет индекс сам
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(sender, instance, **kwargs):
+    schedule_search_index([instance.id])
+
+
+@receiver([post_save, post_delete], sender=AmountIngredient)
+def update_amount_recipe_search(sender, instance, **kwargs):
+    schedule_search_index([instance.recipe_id])
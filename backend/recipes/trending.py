@@ -0,0 +1,103 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Favorite, Recipe, ShoppingCart, TrendingState
+
+# Популярность рецепта — сумма весов событий (добавлений в избранное
+# и в корзину), которые затухают экспоненциально с периодом полураспада
+# TRENDING_HALF_LIFE_HOURS. Чтобы не пересчитывать затухание всех
+# рецептов при каждом запуске, в Recipe.trending_score хранится вклад
+# событий, приведенный к точке отсчета epoch:
+#     weight * 2 ** ((created - epoch) / half_life).
+# Текущая популярность отличается от него общим для всех рецептов
+# множителем, поэтому порядок по trending_score совпадает с порядком
+# по популярности, а новые события достаточно прибавить к сохраненным
+# значениям. События группируются по часам, так что пересчет читает
+# агрегаты, а не отдельные строки.
+EVENT_WEIGHTS = ((Favorite, 1.0), (ShoppingCart, 2.0))
+# Вклад новых событий растет со временем. Когда точка отсчета отстает
+# больше чем на столько периодов полураспада, она переносится вперед,
+# чтобы значения оставались в пределах float
+REBASE_AFTER = 100
+# События последних секунд могут принадлежать еще не завершенным
+# транзакциям, их учтет следующий запуск
+COMMIT_LAG = timedelta(minutes=1)
+
+
+def get_half_life():
+    return timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS)
+
+
+def get_decay(delta):
+    '''Множитель затухания за промежуток времени delta.'''
+    return 2 ** (-delta / get_half_life())
+
+
+def get_score_deltas(lower, upper, epoch):
+    # Вклад событий из промежутка (lower, upper] по рецептам. Событие
+    # считается произошедшим в середине своего часа
+    deltas = defaultdict(float)
+    for model, weight in EVENT_WEIGHTS:
+        events = model.objects.filter(created__lte=upper)
+        if lower is not None:
+            events = events.filter(created__gt=lower)
+        rows = events.annotate(hour=TruncHour('created')).order_by().values(
+            'recipe_id', 'hour'
+        ).annotate(total=Count('id')).values_list(
+            'recipe_id', 'hour', 'total'
+        )
+        for recipe_id, hour, total in rows:
+            middle = hour + timedelta(minutes=30)
+            deltas[recipe_id] += weight * total / get_decay(middle - epoch)
+    return deltas
+
+
+def add_scores(deltas):
+    # Прибавление одним UPDATE на рецепт без чтения текущих значений
+    table = connection.ops.quote_name(Recipe._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {table} SET trending_score = trending_score + %s '
+            'WHERE id = %s',
+            [(delta, recipe_id) for recipe_id, delta in deltas.items()],
+        )
+
+
+def update_trending(full=False, now=None):
+    '''Учитывает в популярности рецептов события с прошлого запуска.
+
+    Удаление из избранного и корзины инкрементально не учитывается: его
+    вклад просто затухает. При full=True популярность считается заново
+    по всем событиям. Возвращает число рецептов с новыми событиями.
+    '''
+    upper = (now or timezone.now()) - COMMIT_LAG
+    hour = upper.replace(minute=0, second=0, microsecond=0)
+    with transaction.atomic():
+        # Блокировка строки состояния исключает параллельные пересчеты
+        state = TrendingState.objects.select_for_update().first()
+        if state is None or full:
+            Recipe.objects.exclude(trending_score=0).update(trending_score=0)
+            TrendingState.objects.all().delete()
+            state = TrendingState(epoch=hour)
+            lower = None
+        else:
+            lower = state.processed_until
+            if upper <= lower:
+                return 0
+            if state.epoch + REBASE_AFTER * get_half_life() < upper:
+                Recipe.objects.exclude(trending_score=0).update(
+                    trending_score=F('trending_score')
+                    * get_decay(hour - state.epoch)
+                )
+                state.epoch = hour
+        deltas = get_score_deltas(lower, upper, state.epoch)
+        add_scores(deltas)
+        state.processed_until = upper
+        state.save()
+    return len(deltas)
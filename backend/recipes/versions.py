@@ -0,0 +1,33 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+
+def get_version_key(model):
+    return f'table-version:{model._meta.label_lower}'
+
+
+def bump_table_version(model):
+    '''Присваивает таблице новую версию и время изменения.'''
+    version = (uuid.uuid4().hex, timezone.now().replace(microsecond=0))
+    cache.set(
+        get_version_key(model), version, settings.TABLE_VERSION_TIMEOUT
+    )
+    return version
+
+
+def get_table_version(model):
+    '''Возвращает пару (версия, время изменения) таблицы из кэша.
+
+    Базу данных не затрагивает: если версии в кэше нет, она создается
+    заново, что лишь заставит клиентов один раз скачать данные повторно.
+    '''
+    version = cache.get(get_version_key(model))
+    if version is None:
+        version = (uuid.uuid4().hex, timezone.now().replace(microsecond=0))
+        if not cache.add(get_version_key(model), version,
+                         settings.TABLE_VERSION_TIMEOUT):
+            version = cache.get(get_version_key(model), version)
+    return version
@@ -1,24 +1,47 @@
 from django.contrib import admin
+from django.contrib.auth.models import Permission
 
+from foodgram.admin_utils import ScalableAdmin
 from .models import Follow, User
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(ScalableAdmin):
     list_display = (
         'id',
         'email',
         'username',
         'first_name',
-        'last_name'
+        'last_name',
+        'recipes_count',
+        'followers_count',
     )
-    list_filter = ('email', 'first_name')
+    list_filter = ('is_staff', 'is_active')
     search_fields = ('email', 'username', 'first_name', 'last_name')
+    # У модели нет порядка по умолчанию, без него страницы
+    # автодополнения автора нестабильны
+    ordering = ('id',)
+    # Счетчики поддерживаются API (recipes.counters), режим ленты —
+    # recipes.feed
+    readonly_fields = (
+        'recipes_count', 'followers_count', 'feed_fanout_on_read'
+    )
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        # Название права включает тип содержимого, без select_related
+        # он загружается отдельно для каждого права в списке
+        if db_field.name == 'user_permissions':
+            kwargs['queryset'] = Permission.objects.select_related(
+                'content_type'
+            )
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
 
 
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(ScalableAdmin):
     list_display = (
         'user',
         'author'
     )
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Авторы, рецепты которых не попали в ленты (recipes 0018_feedentry),
+# читаются при чтении ленты
+def fill_fanout_on_read(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    User.objects.filter(
+        followers_count__gt=settings.FEED_FANOUT_LIMIT
+    ).update(feed_fanout_on_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_counters'),
+        ('recipes', '0018_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_fanout_on_read',
+            field=models.BooleanField(default=False, verbose_name='Лента по чтению'),
+        ),
+        migrations.RunPython(fill_fanout_on_read, migrations.RunPython.noop),
+    ]
@@ -16,6 +16,21 @@ class User(AbstractUser):
         verbose_name='Фамилия',
         max_length=250,
     )
+    # Счетчики поддерживаются представлениями API (см. recipes.counters)
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+    )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+    )
+    # Рецепты автора выбираются при чтении ленты, а не пишутся в ленты
+    # подписчиков (см. recipes.feed)
+    feed_fanout_on_read = models.BooleanField(
+        verbose_name='Лента по чтению',
+        default=False,
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']